@@ -0,0 +1,94 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional
+import main
+from writer import WriteBehind
+
+
+class AsyncStore(object):
+    """asyncio facade of main: every call runs on a small executor (by
+    default one thread per pooled read connection), so no number of waiting
+    coroutines needs more threads. get_latest() calls made in the same event
+    loop iteration are answered by one main.get_latest_many() lookup, and
+    saves go through a WriteBehind group commit.
+
+        store = AsyncStore()
+        await store.save(1, "person", {"firstName": "Ada"})
+        row = await store.get_latest(1)
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_batch: int = 500,
+        writer: Optional[WriteBehind] = None,
+    ) -> None:
+        self.max_batch = max_batch
+        self.batches = 0
+        self.lookups = 0
+        self._executor = ThreadPoolExecutor(
+            workers or main.pool.max_readers, thread_name_prefix="store"
+        )
+        self._writer = writer or WriteBehind()
+        self._pending = {}  # type: Dict[Any, List[asyncio.Future]]
+
+    async def _call(self, function: Callable, *args: Any, **kwargs: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(function, *args, **kwargs)
+        )
+
+    async def save(self, object_id: Any, view: str, data: Any) -> None:
+        """Resolves once the save has been committed."""
+        await asyncio.wrap_future(self._writer.submit(object_id, view, data))
+
+    async def get_latest(self, object_id: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        if not self._pending:
+            # runs after the coroutines that are ready now had their turn
+            loop.call_soon(self._flush, loop)
+        future = loop.create_future()
+        self._pending.setdefault(object_id, []).append(future)
+        return await future
+
+    def _flush(self, loop: asyncio.AbstractEventLoop) -> None:
+        pending, self._pending = self._pending, {}
+        object_ids = list(pending)
+        for start in range(0, len(object_ids), self.max_batch):
+            chunk = {i: pending[i] for i in object_ids[start : start + self.max_batch]}
+            self.batches += 1
+            self.lookups += len(chunk)
+            lookup = loop.run_in_executor(self._executor, main.get_latest_many, list(chunk))
+            lookup.add_done_callback(partial(self._resolve, chunk))
+
+    def _resolve(
+        self, waiting: Dict[Any, List[asyncio.Future]], lookup: asyncio.Future
+    ) -> None:
+        error = lookup.exception()
+        rows = {} if error else lookup.result()
+        for object_id, futures in waiting.items():
+            for future in futures:
+                if future.done():  # cancelled
+                    continue
+                if error:
+                    future.set_exception(error)
+                else:
+                    future.set_result(rows.get(object_id))
+
+    async def get_at(self, object_id: Any, timestamp: int) -> Any:
+        return await self._call(main.get_at, object_id, timestamp)
+
+    async def list_page(self, view: str, cursor: Optional[str] = None, limit: int = 50) -> Any:
+        return await self._call(main.list_page, view, cursor, limit)
+
+    async def find(self, view: str, **fields: Any) -> Any:
+        return await self._call(main.find, view, **fields)
+
+    async def search(self, text: str, view: Optional[str] = None, limit: int = 20) -> Any:
+        return await self._call(main.search, text, view, limit)
+
+    async def close(self) -> None:
+        """Wait for pending saves and stop the threads."""
+        await self._call(self._writer.close)
+        self._executor.shutdown()
@@ -0,0 +1,193 @@
+"""Load test of the object store with a mix of operations on a temporary
+database, printing the results as JSON to compare them across commits:
+
+    python bench.py --objects 100000 --threads 4 --mix save=1,get=8,list=1,search=1
+    python bench.py --shards 4 --duration 30 -o after.json
+
+Objects are generated from the type definitions.
+"""
+import json
+import random
+import subprocess
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from datetime import date, timedelta
+from pathlib import Path
+import main
+import typedefs
+
+words = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo lima "
+    "mike november oscar papa quebec romeo sierra tango uniform victor whiskey "
+    "xray yankee zulu apple banana cherry dune ember falcon glacier harbor "
+    "island jungle lantern meadow nebula orchid prairie quartz river summit"
+).split()
+
+
+def synthetic(definition, rng):
+    """Random object with a value for every field of the definition."""
+    generators = dict(
+        text=lambda: " ".join(rng.choices(words, k=rng.randint(1, 4))).title(),
+        date=lambda: (date(1950, 1, 1) + timedelta(rng.randrange(25000))).isoformat(),
+        number=lambda: round(rng.uniform(0, 1000), 2),
+        integer=lambda: rng.randrange(1000),
+        boolean=lambda: rng.random() < 0.5,
+    )
+    return {
+        field["name"]: generators.get(field["type"], generators["text"])()
+        for field in definition.get("fields", [])
+    }
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in operations:
+            raise ValueError(f"unknown operation {name!r}, one of {sorted(operations)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def op_save(state, rng):
+    view = rng.choice(state["views"])
+    object_id = rng.randrange(state["objects"] * 11 // 10)  # some new objects
+    main.save(object_id, view, synthetic(state["definitions"][view], rng))
+
+
+def op_get(state, rng):
+    main.get_latest(rng.randrange(state["objects"]))
+
+
+def op_list(state, rng):
+    view = rng.choice(state["views"])
+    cursor = main.encode_cursor(main.get_view_id(view), rng.randrange(state["objects"]))
+    main.list_page(view, cursor)
+
+
+def op_search(state, rng):
+    main.search(rng.choice(words))
+
+
+operations = dict(save=op_save, get=op_get, list=op_list, search=op_search)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def load(state, rng, batch=10000):
+    views = state["views"]
+    for start in range(0, state["objects"], batch):
+        items = []
+        for i in range(start, min(start + batch, state["objects"])):
+            view = views[i % len(views)]
+            items.append((i, view, synthetic(state["definitions"][view], rng), None))
+        main.save_many(items)
+
+
+def run(state, mix, threads, duration, seed):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    deadline = time.monotonic() + duration
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        mine = {name: [] for name in names}
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            operations[name](state, rng)
+            mine[name].append(time.perf_counter() - start)
+        for name in names:
+            latencies[name] += mine[name]  # one thread at a time under the GIL
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for name in names + ["all"]:
+        values = sorted(sum(latencies.values(), []) if name == "all" else latencies[name])
+        results[name] = dict(
+            count=len(values),
+            per_second=round(len(values) / elapsed, 1),
+            p50_ms=values and round(percentile(values, 0.5) * 1000, 3),
+            p99_ms=values and round(percentile(values, 0.99) * 1000, 3),
+        )
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="load test of the object store")
+    parser.add_argument("--objects", type=int, default=20000, help="objects to preload")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--mix", default="save=1,get=8,list=1,search=1")
+    parser.add_argument("--types", nargs="*", help="default: all type definitions")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="file to write, default stdout")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    types = args.types or typedefs.list_types()
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        main.open_store(str(Path(directory) / "bench.db"), args.shards)
+        for type_name in types:
+            main.define_type(type_name)
+        state = dict(
+            objects=args.objects,
+            views=types,
+            definitions={t: typedefs.load(t) for t in types},
+        )
+        started = time.perf_counter()
+        load(state, rng)
+        load_seconds = time.perf_counter() - started
+        main.latest.clear()
+        results = run(state, mix, args.threads, args.duration, args.seed)
+        for p in main.shards:
+            p.close()
+        size = sum(f.stat().st_size for f in Path(directory).iterdir())
+
+    report = dict(
+        commit=git_commit(),
+        python=sys.version.split()[0],
+        sqlite=sqlite3.sqlite_version,
+        config=dict(vars(args), mix=mix, types=types),
+        load=dict(
+            seconds=round(load_seconds, 2),
+            objects_per_second=round(args.objects / load_seconds, 1),
+        ),
+        operations=results,
+        database_bytes=size,
+        cache=main.cache_stats(),
+    )
+    out = open(args.output, "w") if args.output else sys.stdout
+    with out:
+        json.dump(report, out, indent=2)
+        out.write("\n")
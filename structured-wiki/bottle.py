@@ -35,9 +35,11 @@ if __name__ == '__main__':
     if _cmd_options.server and _cmd_options.server.startswith('gevent'):
         import gevent.monkey; gevent.monkey.patch_all()
 
-import base64, cgi, email.utils, functools, hmac, itertools, mimetypes,\
-        os, re, subprocess, sys, tempfile, threading, time, warnings, hashlib
+import base64, cgi, email.utils, functools, heapq, hmac, itertools, mimetypes,\
+        os, re, select, socket, stat, subprocess, sys, tempfile, threading, time,\
+        warnings, hashlib, zlib
 
+from collections import OrderedDict
 from datetime import date as datedate, datetime, timedelta
 from tempfile import TemporaryFile
 from traceback import format_exc, print_exc
@@ -79,6 +81,8 @@ except IOError:
 if py3k:
     import http.client as httplib
     import _thread as thread
+    import queue, socketserver
+    from http.server import BaseHTTPRequestHandler
     from urllib.parse import urljoin, SplitResult as UrlSplitResult
     from urllib.parse import urlencode, quote as urlquote, unquote as urlunquote
     urlunquote = functools.partial(urlunquote, encoding='latin1')
@@ -107,6 +111,9 @@ if py3k:
 else: # 2.x
     import httplib
     import thread
+    import Queue as queue, SocketServer as socketserver
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    ConnectionError = socket.error
     from urlparse import urljoin, SplitResult as UrlSplitResult
     from urllib import urlencode, quote as urlquote, unquote as urlunquote
     from Cookie import SimpleCookie
@@ -274,6 +281,15 @@ class Router(object):
         The path-rule is either a static path (e.g. `/contact`) or a dynamic
         path that contains wildcards (e.g. `/wiki/<page>`). The wildcard syntax
         and details on the matching order are described in docs:`routing`.
+
+        With `trie=True`, dynamic routes are indexed by the literal path
+        segments in front of their first wildcard, and only the rules
+        found along the request path are tried (still in the order they
+        were added). This keeps matching fast with many routes.
+
+        With `cache_size`, the results of the most recently matched
+        (method, path) pairs are kept, so repeated requests skip matching
+        altogether. Adding a route empties the cache.
     '''
 
     default_pattern = '[^/]+'
@@ -283,15 +299,26 @@ class Router(object):
     #: than 99 matching groups per regular expression.
     _MAX_GROUPS_PER_PATTERN = 99
 
-    def __init__(self, strict=False):
+    def __init__(self, strict=False, trie=False, cache_size=0):
         self.rules    = [] # All rules in order
         self._groups  = {} # index of regexes to find them in dyna_routes
         self.builder  = {} # Data structure for the url builder
         self.static   = {} # Search structure for static routes
         self.dyna_routes   = {}
         self.dyna_regexes  = {} # Search structure for dynamic routes
+        self.dyna_tries    = {} # Search structure for dynamic routes (trie mode)
+        self._prefixes = {} # flat pattern -> literal segments before wildcards
+        self._matchers = {} # flat pattern -> compiled match function
         #: If true, static routes are no longer checked first.
         self.strict_order = strict
+        #: If true, dynamic routes are searched in a segment trie.
+        self.trie = trie
+        #: Number of (method, path) match results to keep, 0 disables the cache.
+        self.cache_size = cache_size
+        self.cache_hits = self.cache_misses = 0
+        self._cache = OrderedDict() # (verb, path) -> (target, url_args)
+        self._cache_lock = threading.Lock()
+        self._cache_generation = 0 # Counts add() calls
         self.filters = {
             're':    lambda conf:
                 (_re_flatten(conf or self.default_pattern), None, None),
@@ -329,12 +356,16 @@ class Router(object):
 
     def add(self, rule, method, target, name=None):
         ''' Add a new rule or replace the target for an existing rule. '''
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_generation += 1
         anons     = 0    # Number of anonymous wildcards found
         keys      = []   # Names of keys
         pattern   = ''   # Regular expression pattern with named groups
         filters   = []   # Lists of wildcard input filters
         builder   = []   # Data structure for the URL builder
         is_static = True
+        prefix    = ''   # Literal text before the first wildcard
 
         for key, mode, conf in self._itertokens(rule):
             if mode:
@@ -353,6 +384,7 @@ class Router(object):
             elif key:
                 pattern += re.escape(key)
                 builder.append((None, key))
+                if is_static: prefix = key
 
         self.builder[rule] = builder
         if name: self.builder[name] = builder
@@ -385,6 +417,10 @@ class Router(object):
 
         flatpat = _re_flatten(pattern)
         whole_rule = (rule, flatpat, target, getargs)
+        # Only whole segments count, e.g. ('wiki',) for /wiki/<page> and
+        # /wiki/page<id>, () for /<page> or <page>
+        self._prefixes[flatpat] = tuple(prefix.split('/')[1:-1]) \
+            if prefix.startswith('/') else ()
 
         if (flatpat, method) in self._groups:
             if DEBUG:
@@ -399,6 +435,9 @@ class Router(object):
 
     def _compile(self, method):
         all_rules = self.dyna_routes[method]
+        if self.trie:
+            self._compile_trie(method, all_rules)
+            return
         comborules = self.dyna_regexes[method] = []
         maxgroups = self._MAX_GROUPS_PER_PATTERN
         for x in range(0, len(all_rules), maxgroups):
@@ -409,6 +448,35 @@ class Router(object):
             rules = [(target, getargs) for (_, _, target, getargs) in some]
             comborules.append((combined, rules))
 
+    def _compile_trie(self, method, all_rules):
+        # node: [{segment: child node}, [(index, match, target, getargs)]]
+        root, size = self.dyna_tries.get(method, (None, 0))
+        if root is None or len(all_rules) != size + 1: # A rule was replaced
+            root, size = [{}, []], 0
+        for index in range(size, len(all_rules)):
+            _, flatpat, target, getargs = all_rules[index]
+            match = self._matchers.get(flatpat)
+            if match is None:
+                match = self._matchers[flatpat] = re.compile('^%s$' % flatpat).match
+            node = root
+            for segment in self._prefixes[flatpat]:
+                node = node[0].setdefault(segment, [{}, []])
+            node[1].append((index, match, target, getargs))
+        self.dyna_tries[method] = (root, len(all_rules))
+
+    def _trie_match(self, root, path):
+        # Collect the rules of all nodes along the path. A rule can only
+        # match if the path starts with its literal segments.
+        node, found = root, [root[1]] if root[1] else []
+        for segment in path.split('/')[1:-1]:
+            node = node[0].get(segment)
+            if node is None: break
+            if node[1]: found.append(node[1])
+        candidates = found[0] if len(found) == 1 else heapq.merge(*found)
+        for _, match, target, getargs in candidates:
+            if match(path):
+                return target, getargs
+
     def build(self, _name, *anons, **query):
         ''' Build an URL by filling the wildcards in a rule. '''
         builder = self.builder.get(_name)
@@ -422,6 +490,33 @@ class Router(object):
 
     def match(self, environ):
         ''' Return a (target, url_agrs) tuple or raise HTTPError(400/404/405). '''
+        if not self.cache_size:
+            return self._match(environ)
+        key = environ['REQUEST_METHOD'].upper(), environ['PATH_INFO'] or '/'
+        with self._cache_lock:
+            found = self._cache.get(key)
+            if found is not None:
+                self._cache[key] = self._cache.pop(key) # Most recently used
+                self.cache_hits += 1
+                return found[0], dict(found[1])
+            self.cache_misses += 1
+            generation = self._cache_generation
+        # Errors are not cached, so unknown paths cannot flush the cache
+        target, url_args = self._match(environ)
+        with self._cache_lock:
+            if generation == self._cache_generation: # No add() in between
+                self._cache[key] = target, dict(url_args)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return target, url_args
+
+    def cache_stats(self):
+        ''' Hits, misses and size of the match cache. '''
+        with self._cache_lock:
+            return dict(hits=self.cache_hits, misses=self.cache_misses,
+                        size=len(self._cache), maxsize=self.cache_size)
+
+    def _match(self, environ):
         verb = environ['REQUEST_METHOD'].upper()
         path = environ['PATH_INFO'] or '/'
         target = None
@@ -434,6 +529,11 @@ class Router(object):
             if method in self.static and path in self.static[method]:
                 target, getargs = self.static[method][path]
                 return target, getargs(path) if getargs else {}
+            elif method in self.dyna_tries:
+                found = self._trie_match(self.dyna_tries[method][0], path)
+                if found:
+                    target, getargs = found
+                    return target, getargs(path) if getargs else {}
             elif method in self.dyna_regexes:
                 for combined, rules in self.dyna_regexes[method]:
                     match = combined(path)
@@ -447,6 +547,9 @@ class Router(object):
         for method in set(self.static) - nocheck:
             if path in self.static[method]:
                 allowed.add(method)
+        for method in set(self.dyna_tries) - allowed - nocheck:
+            if self._trie_match(self.dyna_tries[method][0], path):
+                allowed.add(method)
         for method in set(self.dyna_regexes) - allowed - nocheck:
             for combined, rules in self.dyna_regexes[method]:
                 match = combined(path)
@@ -1789,6 +1892,104 @@ class TemplatePlugin(object):
             return callback
 
 
+class CompressionPlugin(object):
+    ''' This plugin compresses text responses of status 200 with gzip or
+        deflate, if the client accepts one of them. Strings are compressed as
+        a whole (with a new ``Content-Length``), iterables incrementally with
+        a sync flush after every chunk, so streamed parts are not held back.
+        Bodies smaller than `min_size`, files, responses that already have a
+        ``Content-Encoding``, event streams and routes with a `compress`
+        config parameter of False are sent as they are. '''
+    name = 'compress'
+    api  = 2
+    codings = (('gzip', 31), ('deflate', 15)) # zlib wbits of each
+    compressible = ('text/', 'application/javascript', 'application/json',
+                    'application/xml', 'image/svg+xml')
+
+    def __init__(self, level=6, min_size=1024, types=None):
+        self.level = level
+        self.min_size = min_size
+        if types is not None: self.compressible = tuple(types)
+
+    def apply(self, callback, route):
+        if route.config.get('compress', True) is False: return callback
+        def wrapper(*a, **ka):
+            rv = callback(*a, **ka)
+            if isinstance(rv, HTTPResponse):
+                rv.body = self.compress(rv, rv.body)
+                return rv
+            return self.compress(response, rv)
+        return wrapper
+
+    def compress(self, res, body):
+        ''' Return `body` compressed, or unchanged, and set the headers of
+            the response `res` accordingly. '''
+        if not body or res.status_code != 200 or 'Content-Encoding' in res \
+        or hasattr(body, 'read') or isinstance(body, dict):
+            return body
+        ctype = res.content_type or res.default_content_type
+        if not ctype.startswith(self.compressible) \
+        or ctype.startswith('text/event-stream'):
+            return body
+        vary = res.get_header('Vary')
+        if not vary:
+            res['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            res['Vary'] = vary + ', Accept-Encoding'
+        accepted = request.environ.get('HTTP_ACCEPT_ENCODING', '')
+        for coding, wbits in self.codings:
+            if _accepts_encoding(accepted, coding): break
+        else:
+            return body
+
+        if isinstance(body, (tuple, list)) and body \
+        and isinstance(body[0], (bytes, unicode)):
+            body = body[0][0:0].join(body)
+        if isinstance(body, unicode):
+            body = body.encode(res.charset)
+        if isinstance(body, bytes):
+            if len(body) < self.min_size: return body
+            z = zlib.compressobj(self.level, zlib.DEFLATED, wbits)
+            body = z.compress(body) + z.flush()
+            self._set_encoding(res, coding)
+            res['Content-Length'] = len(body)
+            return body
+
+        # Read ahead until min_size to leave small bodies alone
+        chunks, head, size = iter(body), [], 0
+        for chunk in chunks:
+            if isinstance(chunk, unicode): chunk = chunk.encode(res.charset)
+            head.append(chunk)
+            size += len(chunk)
+            if size >= self.min_size: break
+        else:
+            if hasattr(body, 'close'): body.close()
+            return b''.join(head)
+        self._set_encoding(res, coding)
+        if 'Content-Length' in res: del res['Content-Length']
+        z = zlib.compressobj(self.level, zlib.DEFLATED, wbits)
+        compressed = self._compress_iter(z, b''.join(head), chunks, res.charset)
+        if hasattr(body, 'close'):
+            compressed = _closeiter(compressed, body.close)
+        return compressed
+
+    @staticmethod
+    def _set_encoding(res, coding):
+        res['Content-Encoding'] = coding
+        # Other bytes than the identity body need their own validator
+        etag = res.get_header('ETag')
+        if etag and etag.endswith('"'):
+            res['ETag'] = etag[:-1] + '-' + coding + '"'
+
+    @staticmethod
+    def _compress_iter(z, head, chunks, charset):
+        yield z.compress(head) + z.flush(zlib.Z_SYNC_FLUSH)
+        for chunk in chunks:
+            if isinstance(chunk, unicode): chunk = chunk.encode(charset)
+            if chunk: yield z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+        yield z.flush()
+
+
 #: Not a plugin, but part of the plugin API. TODO: Find a better place.
 class _ImportRedirect(object):
     def __init__(self, name, impmask):
@@ -2458,12 +2659,91 @@ def _file_iter_range(fp, offset, bytes, maxread=1024*1024):
         yield part
 
 
+class FileRange(object):
+    ''' A file-like body of `length` bytes at `offset` of an open file. It is
+        passed to ``wsgi.file_wrapper``, and servers that know it can send it
+        with ``os.sendfile`` using :meth:`fileno`, `offset` and `length`. '''
+
+    def __init__(self, fp, offset, length):
+        self.fp, self.offset, self.length = fp, offset, length
+        self._left = length
+        fp.seek(offset)
+
+    def fileno(self):
+        return self.fp.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._left: size = self._left
+        part = self.fp.read(size)
+        self._left -= len(part)
+        return part
+
+    def __iter__(self):
+        while True:
+            part = self.read(64*1024)
+            if not part: break
+            yield part
+
+    def close(self):
+        self.fp.close()
+
+
+#: Seconds for which :func:`static_file` trusts cached file metadata.
+STATIC_STAT_TTL = 1.0
+_static_stats = {} # filename -> (expires, (size, mtime, etag) or error status)
+_static_mimetypes = {} # filename -> (mimetype, encoding)
+#: Precompressed siblings tried by :func:`static_file`, in order of preference.
+static_encodings = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _stat_static(filename):
+    ''' (size, mtime, etag) of a readable file, or 403/404. Results are cached
+        for STATIC_STAT_TTL seconds. '''
+    now = time.time()
+    cached = _static_stats.get(filename)
+    if cached and cached[0] > now: return cached[1]
+    try:
+        stats = os.stat(filename)
+        if not stat.S_ISREG(stats.st_mode):
+            result = 404
+        elif not os.access(filename, os.R_OK):
+            result = 403
+        else:
+            etag = '"%x-%x-%x"' % (stats.st_ino, stats.st_mtime_ns, stats.st_size)
+            result = (stats.st_size, stats.st_mtime, etag)
+    except OSError:
+        result = 404
+    if len(_static_stats) > 10000: _static_stats.clear()
+    _static_stats[filename] = (now + STATIC_STAT_TTL, result)
+    return result
+
+
+def _accepts_encoding(header, coding):
+    ''' True if an Accept-Encoding header allows `coding`, by name or ``*``.
+        Unparsable q values count as 1. '''
+    found = {}
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        name = name.strip().lower()
+        if name not in (coding, '*'): continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try: q = float(value)
+                except ValueError: q = 1.0
+        found.setdefault(name, q > 0)
+    return found.get(coding, found.get('*', False))
+
+
 def static_file(filename, root, mimetype='auto', download=False, charset='UTF-8'):
     """ Open a file in a safe way and return :exc:`HTTPResponse` with status
-        code 200, 305, 403 or 404. The ``Content-Type``, ``Content-Encoding``,
-        ``Content-Length`` and ``Last-Modified`` headers are set if possible.
-        Special support for ``If-Modified-Since``, ``Range`` and ``HEAD``
-        requests.
+        code 200, 206, 304, 403, 404 or 416. The ``Content-Type``,
+        ``Content-Encoding``, ``Content-Length``, ``Last-Modified`` and
+        ``ETag`` headers are set if possible. Special support for
+        ``If-None-Match``, ``If-Modified-Since``, ``Range`` and ``HEAD``
+        requests. A ``.br`` or ``.gz`` file next to the requested one is sent
+        instead if the client accepts that encoding.
 
         :param filename: Name or path of the file to send.
         :param root: Root path for file lookups. Should be an absolute directory
@@ -2484,13 +2764,16 @@ def static_file(filename, root, mimetype='auto', download=False, charset='UTF-8'
 
     if not filename.startswith(root):
         return HTTPError(403, "Access denied.")
-    if not os.path.exists(filename) or not os.path.isfile(filename):
+    stats = _stat_static(filename)
+    if stats == 404:
         return HTTPError(404, "File does not exist.")
-    if not os.access(filename, os.R_OK):
+    if stats == 403:
         return HTTPError(403, "You do not have permission to access this file.")
 
     if mimetype == 'auto':
-        mimetype, encoding = mimetypes.guess_type(filename)
+        if filename not in _static_mimetypes:
+            _static_mimetypes[filename] = mimetypes.guess_type(filename)
+        mimetype, encoding = _static_mimetypes[filename]
         if encoding: headers['Content-Encoding'] = encoding
 
     if mimetype:
@@ -2502,22 +2785,38 @@ def static_file(filename, root, mimetype='auto', download=False, charset='UTF-8'
         download = os.path.basename(filename if download == True else download)
         headers['Content-Disposition'] = 'attachment; filename="%s"' % download
 
-    stats = os.stat(filename)
-    headers['Content-Length'] = clen = stats.st_size
-    lm = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(stats.st_mtime))
+    if 'Content-Encoding' not in headers:
+        accepted = request.environ.get('HTTP_ACCEPT_ENCODING', '')
+        for coding, suffix in static_encodings:
+            variant = _stat_static(filename + suffix)
+            if isinstance(variant, int): continue
+            headers['Vary'] = 'Accept-Encoding'
+            if _accepts_encoding(accepted, coding):
+                headers['Content-Encoding'] = coding
+                filename, stats = filename + suffix, variant
+                break
+
+    clen, mtime, etag = stats
+    headers['Content-Length'] = clen
+    headers['ETag'] = etag
+    lm = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(mtime))
     headers['Last-Modified'] = lm
 
-    ims = request.environ.get('HTTP_IF_MODIFIED_SINCE')
-    if ims:
-        ims = parse_date(ims.split(";")[0].strip())
-    if ims is not None and ims >= int(stats.st_mtime):
+    inm = request.environ.get('HTTP_IF_NONE_MATCH')
+    if inm is not None:
+        # If-None-Match takes precedence over If-Modified-Since
+        not_modified = inm.strip() == '*' or etag in [
+            t.strip().replace('W/', '', 1) for t in inm.split(',')]
+    else:
+        ims = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+        if ims:
+            ims = parse_date(ims.split(";")[0].strip())
+        not_modified = ims is not None and ims >= int(mtime)
+    if not_modified:
         headers['Date'] = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
         return HTTPResponse(status=304, **headers)
 
-    body = '' if request.method == 'HEAD' else open(filename, 'rb')
-
     headers["Accept-Ranges"] = "bytes"
-    ranges = request.environ.get('HTTP_RANGE')
     if 'HTTP_RANGE' in request.environ:
         ranges = list(parse_range_header(request.environ['HTTP_RANGE'], clen))
         if not ranges:
@@ -2525,11 +2824,196 @@ def static_file(filename, root, mimetype='auto', download=False, charset='UTF-8'
         offset, end = ranges[0]
         headers["Content-Range"] = "bytes %d-%d/%d" % (offset, end-1, clen)
         headers["Content-Length"] = str(end-offset)
-        if body: body = _file_iter_range(body, offset, end-offset)
+        body = '' if request.method == 'HEAD' else \
+            FileRange(open(filename, 'rb'), offset, end-offset)
         return HTTPResponse(body, status=206, **headers)
+    body = '' if request.method == 'HEAD' else FileRange(open(filename, 'rb'), 0, clen)
     return HTTPResponse(body, **headers)
 
 
+class StaticCache(object):
+    ''' Opt-in memory cache for small static files, used like
+        :func:`static_file`::
+
+            assets = StaticCache()
+
+            @route('/static/<path:path>')
+            def static(path):
+                return assets.serve(path, root='./assets')
+
+        Files up to `max_file_size` bytes are kept with their response
+        headers and compressed variants (``.br``/``.gz`` siblings, or gzip
+        made on load for text types) until `max_bytes` are used, evicting
+        the least recently used. A cached file is served without system
+        calls and only stat'ed again after `revalidate` seconds. Other
+        files are passed on to :func:`static_file`. '''
+
+    compressible = ('text/', 'application/javascript', 'application/json',
+                    'application/xml', 'image/svg+xml')
+
+    def __init__(self, max_bytes=16*1024*1024, max_file_size=512*1024,
+                 revalidate=2.0, compress=True):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.revalidate = revalidate
+        self.compress = compress
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict() # key -> entry dict
+        self._lock = threading.Lock()
+
+    def _load(self, filename, mimetype, charset):
+        try:
+            stats = os.stat(filename)
+        except OSError:
+            return None
+        if not stat.S_ISREG(stats.st_mode) or stats.st_size > self.max_file_size:
+            return None
+        try:
+            with open(filename, 'rb') as fp: data = fp.read()
+        except IOError:
+            return None
+        headers = {}
+        encoding = None
+        if mimetype == 'auto':
+            mimetype, encoding = mimetypes.guess_type(filename)
+            if encoding: headers['Content-Encoding'] = encoding
+        if mimetype:
+            if mimetype[:5] == 'text/' and charset and 'charset' not in mimetype:
+                mimetype += '; charset=%s' % charset
+            headers['Content-Type'] = mimetype
+        headers['Last-Modified'] = time.strftime("%a, %d %b %Y %H:%M:%S GMT",
+                                                 time.gmtime(stats.st_mtime))
+        headers['Accept-Ranges'] = 'bytes'
+        etag = '"%x-%x-%x"' % (stats.st_ino, stats.st_mtime_ns, stats.st_size)
+        variants = [(None, data, etag)]
+        files = [(filename, self._signature(stats))]
+        if not encoding:
+            for coding, suffix in static_encodings:
+                try:
+                    with open(filename + suffix, 'rb') as fp:
+                        sibling = os.fstat(fp.fileno())
+                        variants.append((coding, fp.read(), '"%x-%x-%x"' % (
+                            sibling.st_ino, sibling.st_mtime_ns, sibling.st_size)))
+                    files.append((filename + suffix, self._signature(sibling)))
+                except (IOError, OSError):
+                    files.append((filename + suffix, None))
+            if self.compress and len(variants) == 1 and mimetype \
+            and mimetype.startswith(self.compressible):
+                import gzip
+                packed = gzip.compress(data, 9)
+                if len(packed) < len(data) * 0.9:
+                    variants.append(('gzip', packed, etag[:-1] + '-gzip"'))
+            if len(variants) > 1: headers['Vary'] = 'Accept-Encoding'
+        return dict(mtime=stats.st_mtime, files=files, checked=time.time(),
+                    headers=headers, variants=variants,
+                    cost=sum(len(body) for _, body, _ in variants))
+
+    @staticmethod
+    def _signature(stats):
+        return (stats.st_mtime_ns, stats.st_size, stats.st_ino)
+
+    def _fresh(self, entry):
+        # Siblings count too, missing ones included: a regenerated or new
+        # .br/.gz must not be served from the cache.
+        for path, signature in entry['files']:
+            try:
+                current = self._signature(os.stat(path))
+            except OSError:
+                current = None
+            if current != signature: return False
+        return True
+
+    def _lookup(self, key, filename, mimetype, charset):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = self._entries.pop(key) # Most recently used
+        if entry is not None and now - entry['checked'] > self.revalidate:
+            if self._fresh(entry):
+                entry['checked'] = now
+            else:
+                self._drop(key)
+                entry = None
+        if entry is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = self._load(filename, mimetype, charset)
+        if entry is not None and entry['cost'] <= self.max_bytes:
+            with self._lock:
+                old = self._entries.pop(key, None)
+                if old: self.size -= old['cost']
+                self._entries[key] = entry
+                self.size += entry['cost']
+                while self.size > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.size -= evicted['cost']
+                    self.evictions += 1
+        return entry
+
+    def _drop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry: self.size -= entry['cost']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        ''' Hits, misses, evictions, entries and bytes used. '''
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        evictions=self.evictions, entries=len(self._entries),
+                        size=self.size, max_bytes=self.max_bytes)
+
+    def serve(self, filename, root, mimetype='auto', charset='UTF-8'):
+        ''' Like :func:`static_file` (without `download`). '''
+        root = os.path.abspath(root) + os.sep
+        path = os.path.abspath(os.path.join(root, filename.strip('/\\')))
+        if not path.startswith(root):
+            return HTTPError(403, "Access denied.")
+        entry = self._lookup((path, mimetype, charset), path, mimetype, charset)
+        if entry is None:
+            return static_file(filename, root, mimetype=mimetype, charset=charset)
+
+        accepted = request.environ.get('HTTP_ACCEPT_ENCODING', '')
+        # Siblings in static_encodings order, then made gzip, then identity.
+        for coding, body, etag in entry['variants'][1:] + entry['variants'][:1]:
+            if coding is None or _accepts_encoding(accepted, coding): break
+        headers = dict(entry['headers'])
+        headers['ETag'] = etag
+        if coding: headers['Content-Encoding'] = coding
+
+        inm = request.environ.get('HTTP_IF_NONE_MATCH')
+        if inm is not None:
+            not_modified = inm.strip() == '*' or etag in [
+                t.strip().replace('W/', '', 1) for t in inm.split(',')]
+        else:
+            ims = request.environ.get('HTTP_IF_MODIFIED_SINCE')
+            if ims:
+                ims = parse_date(ims.split(";")[0].strip())
+            not_modified = ims is not None and ims >= int(entry['mtime'])
+        if not_modified:
+            headers['Date'] = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
+            return HTTPResponse(status=304, **headers)
+
+        status = 200
+        if 'HTTP_RANGE' in request.environ:
+            ranges = list(parse_range_header(request.environ['HTTP_RANGE'], len(body)))
+            if not ranges:
+                return HTTPError(416, "Requested Range Not Satisfiable")
+            offset, end = ranges[0]
+            headers["Content-Range"] = "bytes %d-%d/%d" % (offset, end-1, len(body))
+            body, status = body[offset:end], 206
+        headers['Content-Length'] = len(body)
+        if request.method == 'HEAD': body = ''
+        return HTTPResponse(body, status=status, **headers)
+
+
 
 
 
@@ -2799,6 +3283,331 @@ class WSGIRefServer(ServerAdapter):
         srv.serve_forever()
 
 
+class _BodyReader(object):
+    """ ``wsgi.input`` that stops at the end of the request body, so the next
+        request on a kept-alive connection is not read by the application. """
+
+    def __init__(self, rfile, length):
+        self.rfile, self.left = rfile, length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.left: size = self.left
+        data = self.rfile.read(size) if size else b''
+        self.left = self.left - len(data) if data else 0
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.left: size = self.left
+        data = self.rfile.readline(size) if size else b''
+        self.left = self.left - len(data) if data else 0
+        return data
+
+    def readlines(self, hint=-1):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+
+class _FileWrapper(object):
+    """ ``wsgi.file_wrapper`` of :class:`ThreadedServer`. """
+
+    def __init__(self, filelike, blksize=64*1024):
+        self.filelike, self.blksize = filelike, blksize
+
+    def __iter__(self):
+        read, blksize = self.filelike.read, self.blksize
+        part = read(blksize)
+        while part:
+            yield part
+            part = read(blksize)
+
+    def close(self):
+        if hasattr(self.filelike, 'close'): self.filelike.close()
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    """ Runs the WSGI application for each request of a connection, one
+        after the other, until the client or the server closes it. """
+    protocol_version = 'HTTP/1.1'
+    server_version = 'Bottle/' + __version__
+    drain_limit = 64*1024 # Unread request bodies up to this size are skipped
+
+    def setup(self):
+        self.timeout = self.server.timeout
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            poller.register(self.connection, select.POLLIN)
+            self._readable = lambda t: poller.poll(t * 1000)
+        else:
+            self._readable = lambda t: select.select([self.connection], [], [], t)[0]
+
+    def handle(self):
+        self.close_connection = True
+        try:
+            self.handle_one_request()
+            while not self.close_connection and self._wait_for_request():
+                self.handle_one_request()
+        except (socket.timeout, ConnectionError):
+            self.close_connection = True
+
+    def _wait_for_request(self):
+        """ True once the next request can be read, False if the connection
+            was idle for `keepalive` seconds, the server stops or other
+            connections are waiting for a thread. """
+        self.connection.settimeout(0)
+        try:
+            if self.rfile.peek(1): return True # Pipelined
+        finally:
+            self.connection.settimeout(self.timeout)
+        server = self.server
+        deadline = time.time() + server.keepalive
+        while not server.stopping and not server.waiting():
+            left = deadline - time.time()
+            if left <= 0: break
+            if self._readable(min(left, 0.1)): return True
+        return False
+
+    def handle_one_request(self):
+        self.raw_requestline = self.rfile.readline(65537)
+        while self.raw_requestline in (b'\r\n', b'\n'): # After a POST body
+            self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = self.request_version = self.command = ''
+            self.send_error(414)
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if not self.parse_request(): return
+        self.run_wsgi()
+
+    def make_environ(self):
+        path, _, query = self.path.partition('?')
+        env = {'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+               'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+               'wsgi.multiprocess': False, 'wsgi.run_once': False,
+               'wsgi.file_wrapper': _FileWrapper,
+               'SERVER_SOFTWARE': self.version_string(),
+               'SERVER_NAME': self.server.server_name,
+               'SERVER_PORT': str(self.server.server_port),
+               'SERVER_PROTOCOL': self.request_version,
+               'REQUEST_METHOD': self.command, 'SCRIPT_NAME': '',
+               'PATH_INFO': urlunquote(path), 'QUERY_STRING': query,
+               'REMOTE_ADDR': self.client_address[0]}
+        for name, value in self.headers.items():
+            key = name.replace('-', '_').upper()
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'): key = 'HTTP_' + key
+            env[key] = env[key] + ',' + value if key in env else value
+        if 'chunked' in env.get('HTTP_TRANSFER_ENCODING', '').lower():
+            # The application decodes it and may stop anywhere
+            env['wsgi.input'] = self.rfile
+            self.close_connection = True
+        else:
+            length = env.get('CONTENT_LENGTH', '0').strip() or '0'
+            env['wsgi.input'] = self._input = _BodyReader(self.rfile, int(length))
+        return env
+
+    def run_wsgi(self):
+        self._input = None
+        self._response = None
+        self._head_sent = self._chunked = False
+        self._sent = 0
+        try:
+            env = self.make_environ()
+        except ValueError:
+            self.close_connection = True
+            self.send_error(400, "Bad Content-Length")
+            return
+        result = None
+        try:
+            result = self.server.app(env, self._start_response)
+            if isinstance(result, (list, tuple)) and self._response \
+            and 'content-length' not in self._header_names():
+                self._response[1].append(('Content-Length',
+                                          str(sum(len(part) for part in result))))
+            filelike = getattr(result, 'filelike', None)
+            if isinstance(result, _FileWrapper) and isinstance(filelike, FileRange) \
+            and hasattr(self.connection, 'sendfile') and self._response \
+            and 'content-length' in self._header_names():
+                self._send_head(b'')
+                if self._body_allowed():
+                    self._sent += self.connection.sendfile(
+                        filelike.fp, filelike.offset, filelike.length)
+            else:
+                for data in result:
+                    if data: self._write(data)
+                if not self._head_sent: self._send_head(b'')
+                if self._chunked: self.wfile.write(b'0\r\n\r\n')
+        except (socket.timeout, ConnectionError):
+            self.close_connection = True
+            return
+        except Exception:
+            self.close_connection = True
+            if self._head_sent: raise # Nothing left to tell the client
+            print_exc()
+            self._response = ('500 Internal Server Error', [
+                ('Content-Type', 'text/plain'), ('Content-Length', '21')])
+            self._send_head(b'Internal Server Error')
+        finally:
+            if hasattr(result, 'close'): result.close()
+        if self._input is not None and self._input.left \
+        and not self.close_connection:
+            self._input.read() # At most drain_limit, see _send_head()
+        self.log_request(self._response[0][:3], self._sent)
+
+    def _start_response(self, status, headers, exc_info=None):
+        if exc_info:
+            try:
+                if self._head_sent: _raise(*exc_info)
+            finally:
+                exc_info = None
+        elif self._response is not None:
+            raise AssertionError("start_response() was called already")
+        self._response = (status, list(headers))
+        return self._write
+
+    def _header_names(self):
+        return set(name.lower() for name, _ in self._response[1])
+
+    def _body_allowed(self):
+        code = int(self._response[0][:3])
+        return self.command != 'HEAD' and code >= 200 and code not in (204, 304)
+
+    def _send_head(self, data):
+        status, headers = self._response
+        names = self._header_names()
+        if 'content-length' not in names and self._body_allowed():
+            if self.request_version == 'HTTP/1.1':
+                self._chunked = True
+            else:
+                self.close_connection = True
+        if self.server.stopping or self._input is not None \
+        and self._input.left > self.drain_limit:
+            self.close_connection = True
+        out = ['%s %s\r\n' % (self.protocol_version, status)]
+        for name, value in headers:
+            if name.lower() == 'connection':
+                if value.lower() == 'close': self.close_connection = True
+                continue
+            out.append('%s: %s\r\n' % (name, value))
+        if 'date' not in names: out.append('Date: %s\r\n' % self.date_time_string())
+        if 'server' not in names: out.append('Server: %s\r\n' % self.version_string())
+        if self._chunked: out.append('Transfer-Encoding: chunked\r\n')
+        if self.close_connection:
+            out.append('Connection: close\r\n')
+        elif self.request_version == 'HTTP/1.0':
+            out.append('Connection: keep-alive\r\n')
+        out.append('\r\n')
+        self._head_sent = True
+        self.wfile.write(tob(''.join(out), 'latin1') + self._frame(data))
+
+    def _frame(self, data):
+        if not data or not self._body_allowed(): return b''
+        self._sent += len(data)
+        if self._chunked: return tob('%x\r\n' % len(data)) + data + b'\r\n'
+        return data
+
+    def _write(self, data):
+        if not self._head_sent:
+            self._send_head(data)
+        else:
+            data = self._frame(data)
+            if data: self.wfile.write(data)
+
+    def log_message(self, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+
+class _ThreadedHTTPServer(socketserver.TCPServer):
+    """ Accepts connections and hands them to a fixed number of threads. """
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, app, threads=16, keepalive=5.0, timeout=30.0,
+                 quiet=False, handler_class=_KeepAliveHandler):
+        if ':' in address[0]: self.address_family = socket.AF_INET6
+        self.app, self.keepalive, self.timeout = app, keepalive, timeout
+        self.quiet = quiet
+        self.stopping = False
+        self._queue = queue.Queue()
+        socketserver.TCPServer.__init__(self, address, handler_class)
+        self.server_name = address[0]
+        self.server_port = self.server_address[1]
+        self._threads = []
+        for i in range(threads):
+            t = threading.Thread(target=self._work, name='bottle-%d' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def process_request(self, request, client_address):
+        self._queue.put((request, client_address))
+
+    def waiting(self):
+        """ True if accepted connections wait for a thread. """
+        return not self._queue.empty()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None: break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def stop(self, timeout=10.0):
+        """ Stop accepting, finish the requests that are in progress or
+            accepted already, close idle connections and wait up to `timeout`
+            seconds for the threads. Call shutdown() first if serve_forever()
+            runs in another thread. """
+        self.stopping = True
+        self.server_close()
+        for _ in self._threads: self._queue.put(None)
+        deadline = time.time() + timeout
+        for t in self._threads:
+            t.join(max(0, deadline - time.time()))
+
+
+class ThreadedServer(ServerAdapter):
+    """ Multi-threaded HTTP/1.1 server of the standard library. A pool of
+        `threads` (16) serves connections, keeping them open for further and
+        pipelined requests for `keepalive` seconds (5), unless connections
+        wait for a free thread. Socket operations time out after `timeout`
+        seconds (30). Responses of unknown length are sent chunked, and
+        :func:`static_file` bodies with ``sendfile``. On SIGTERM,
+        KeyboardInterrupt or :meth:`shutdown`, requests in progress get
+        `shutdown_timeout` seconds (10) to complete. """
+
+    def run(self, app): # pragma: no cover
+        import signal
+        self.srv = srv = _ThreadedHTTPServer((self.host, self.port), app,
+            threads=self.options.get('threads', 16),
+            keepalive=self.options.get('keepalive', 5.0),
+            timeout=self.options.get('timeout', 30.0), quiet=self.quiet)
+        previous = None
+        if threading.current_thread().name == 'MainThread':
+            # serve_forever() runs here, so shutdown() must not
+            stop = lambda *args: threading.Thread(target=srv.shutdown).start()
+            previous = signal.signal(signal.SIGTERM, stop)
+        try:
+            srv.serve_forever()
+        finally:
+            srv.stop(self.options.get('shutdown_timeout', 10.0))
+            if previous is not None: signal.signal(signal.SIGTERM, previous)
+
+    def shutdown(self):
+        """ Make run() return, from another thread. """
+        self.srv.shutdown()
+
+
 class CherryPyServer(ServerAdapter):
     def run(self, handler): # pragma: no cover
         depr("The wsgi server part of cherrypy was split into a new "
@@ -3028,6 +3837,7 @@ server_names = {
     'cgi': CGIServer,
     'flup': FlupFCGIServer,
     'wsgiref': WSGIRefServer,
+    'threaded': ThreadedServer,
     'waitress': WaitressServer,
     'cherrypy': CherryPyServer,
     'cheroot': CherootServer,
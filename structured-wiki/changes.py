@@ -0,0 +1,42 @@
+import threading
+from collections import deque
+from itertools import islice
+from typing import Any, List, Optional, Tuple
+
+
+class ChangeLog(object):
+    """In-process log of the last `maxlen` changes, numbered by a sequence
+    that starts at 1. Readers remember the last sequence number they saw
+    and block in since() until something newer is appended.
+    """
+
+    def __init__(self, maxlen: int = 10000) -> None:
+        self.seq = 0
+        self._entries = deque(maxlen=maxlen)  # type: deque
+        self._changed = threading.Condition()
+
+    def append(self, *changes: Any) -> int:
+        """Log `changes` in order and return the sequence number of the last."""
+        with self._changed:
+            for change in changes:
+                self.seq += 1
+                self._entries.append((self.seq, change))
+            self._changed.notify_all()
+            return self.seq
+
+    def since(
+        self, seq: int, timeout: Optional[float] = None
+    ) -> Optional[List[Tuple[int, Any]]]:
+        """(seq, change) pairs after `seq`, waiting up to `timeout` seconds
+        for the first one (an empty list on timeout). None if some of them
+        are no longer retained, or `seq` is from before a restart, so the
+        reader has to reload whatever it shows.
+        """
+        with self._changed:
+            if seq > self.seq:
+                return None
+            self._changed.wait_for(lambda: self.seq > seq, timeout)
+            oldest = self._entries[0][0] if self._entries else self.seq + 1
+            if seq + 1 < oldest:
+                return None
+            return list(islice(self._entries, seq + 1 - oldest, None))
@@ -0,0 +1,74 @@
+"""Compression of JSON payloads with shared dictionaries.
+
+Objects of one view repeat the same keys and many of the same values, which
+a small per-view dictionary captures much better than compressing every
+payload on its own. zlib is always available, zstd when the `zstandard`
+package is installed.
+
+>>> samples = [b'{"firstName": "Ada", "lastName": "Lovelace"}'] * 3
+>>> d = train("zlib", samples)
+>>> decompress("zlib", d, compress("zlib", d, samples[0])) == samples[0]
+True
+"""
+import re
+import zlib
+from collections import Counter
+from typing import Dict, List
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+dictionary_size = 16 * 1024
+algorithms = ("zlib", "zstd") if zstandard else ("zlib",)
+
+# quoted strings (keys including the colon) and structural characters
+_fragment = re.compile(rb'"(?:[^"\\]|\\.)*"(?:\s*:\s*)?|[\[{]\s*|[,\]}]\s*')
+_zstd_dictionaries = {}  # type: Dict[bytes, zstandard.ZstdCompressionDict]
+
+
+def _train_zlib(samples: List[bytes], size: int) -> bytes:
+    counts = Counter()  # type: Counter
+    for sample in samples:
+        counts.update(set(_fragment.findall(sample)))
+    fragments = sorted(
+        (f for f, n in counts.items() if n > 1), key=lambda f: counts[f] * len(f)
+    )
+    # zlib prefers short distances, so the most valuable fragments go last
+    chosen = []  # type: List[bytes]
+    used = 0
+    for fragment in reversed(fragments):
+        if used + len(fragment) <= size:
+            chosen.append(fragment)
+            used += len(fragment)
+    return b"".join(reversed(chosen))
+
+
+def train(algorithm: str, samples: List[bytes], size: int = dictionary_size) -> bytes:
+    if algorithm == "zstd":
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    return _train_zlib(samples, size)
+
+
+def _zstd_dictionary(dictionary: bytes) -> "zstandard.ZstdCompressionDict":
+    d = _zstd_dictionaries.get(dictionary)
+    if d is None:
+        d = _zstd_dictionaries[dictionary] = zstandard.ZstdCompressionDict(dictionary)
+    return d
+
+
+def compress(algorithm: str, dictionary: bytes, payload: bytes) -> bytes:
+    if algorithm == "zstd":
+        compressor = zstandard.ZstdCompressor(dict_data=_zstd_dictionary(dictionary))
+        return compressor.compress(payload)
+    c = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, dictionary)
+    return c.compress(payload) + c.flush()
+
+
+def decompress(algorithm: str, dictionary: bytes, payload: bytes) -> bytes:
+    if algorithm == "zstd":
+        decompressor = zstandard.ZstdDecompressor(dict_data=_zstd_dictionary(dictionary))
+        return decompressor.decompress(payload)
+    d = zlib.decompressobj(-15, dictionary)
+    return d.decompress(payload) + d.flush()
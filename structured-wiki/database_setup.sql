@@ -1,5 +1,6 @@
 CREATE TABLE IF NOT EXISTS views (
-    name text UNIQUE
+    name text UNIQUE,
+    shard int -- database file holding the objects of the view, null for the first
 );
 
 CREATE UNIQUE INDEX IF NOT EXISTS views_name_index ON views(name);
@@ -9,7 +10,137 @@ CREATE TABLE IF NOT EXISTS objects (
     version int int not null,
     view int REFERENCES views,
     data json,
+    encoding text, -- null for plain JSON, 'delta' for {"base": version, "delta": ...}
     primary key(object_id, version)
 );
 
-CREATE INDEX IF NOT EXISTS version_index ON objects(version);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS version_index ON objects(version);
+
+-- walk the objects ever saved in a view, for "as of" queries
+CREATE INDEX IF NOT EXISTS objects_view_index ON objects(view, object_id);
+
+-- latest version of every object, keyed by object_id; a rowid table
+-- because SQLite ignores expression indexes on WITHOUT ROWID tables here
+CREATE TABLE IF NOT EXISTS objects_latest (
+    view int REFERENCES views,
+    object_id integer primary key,
+    version int not null,
+    data json
+);
+
+CREATE INDEX IF NOT EXISTS objects_latest_view_index ON objects_latest(view, object_id, version);
+
+-- update-or-insert rather than "insert or replace" so that the update and
+-- delete triggers of objects_latest (search index) fire
+DROP TRIGGER IF EXISTS objects_latest_insert;
+CREATE TRIGGER objects_latest_insert AFTER INSERT ON objects
+WHEN new.version >= coalesce(
+    (select version from objects_latest where object_id = new.object_id),
+    new.version
+)
+BEGIN
+    UPDATE objects_latest SET view = new.view, version = new.version, data = new.data
+    WHERE object_id = new.object_id;
+    INSERT OR IGNORE INTO objects_latest VALUES (new.view, new.object_id, new.version, new.data);
+END;
+
+-- backfill databases created before objects_latest existed
+INSERT INTO objects_latest
+SELECT view, object_id, max(version), data FROM objects
+WHERE NOT EXISTS (SELECT 1 FROM objects_latest)
+GROUP BY object_id;
+
+-- fields declared by the type definition of a view, each backed by an
+-- expression index on objects_latest
+CREATE TABLE IF NOT EXISTS indexed_fields (
+    view int REFERENCES views,
+    field text not null,
+    primary key(view, field)
+);
+
+-- full-text index over the text values of the latest version of every object
+CREATE VIRTUAL TABLE IF NOT EXISTS objects_fts USING fts5(
+    view UNINDEXED,
+    body,
+    prefix = '3'
+);
+
+CREATE TRIGGER IF NOT EXISTS objects_fts_insert AFTER INSERT ON objects_latest
+BEGIN
+    INSERT INTO objects_fts(rowid, view, body) VALUES (
+        new.object_id,
+        new.view,
+        (select group_concat(value, ' ') from json_tree(new.data) where type = 'text')
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS objects_fts_update AFTER UPDATE ON objects_latest
+BEGIN
+    DELETE FROM objects_fts WHERE rowid = old.object_id;
+    INSERT INTO objects_fts(rowid, view, body) VALUES (
+        new.object_id,
+        new.view,
+        (select group_concat(value, ' ') from json_tree(new.data) where type = 'text')
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS objects_fts_delete AFTER DELETE ON objects_latest
+BEGIN
+    DELETE FROM objects_fts WHERE rowid = old.object_id;
+END;
+
+-- backfill databases created before objects_fts existed
+INSERT INTO objects_fts(rowid, view, body)
+SELECT object_id, view,
+    (select group_concat(value, ' ') from json_tree(data) where type = 'text')
+FROM objects_latest
+WHERE NOT EXISTS (SELECT 1 FROM objects_fts);
+
+-- reference fields of each view, their object ids are copied into links
+CREATE TABLE IF NOT EXISTS reference_fields (
+    view int REFERENCES views,
+    field text not null,
+    primary key(view, field)
+);
+
+-- links from the latest version of object src to object dst; the
+-- primary key answers "links from", links_dst_index "what links here"
+CREATE TABLE IF NOT EXISTS links (
+    src int not null,
+    dst int not null,
+    field text not null,
+    primary key(src, field, dst)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS links_dst_index ON links(dst, field, src);
+
+CREATE TRIGGER IF NOT EXISTS links_insert AFTER INSERT ON objects_latest
+BEGIN
+    INSERT OR IGNORE INTO links(src, dst, field)
+    SELECT new.object_id, target.value, reference_fields.field
+    FROM reference_fields, json_each(new.data, '$.' || reference_fields.field) AS target
+    WHERE reference_fields.view = new.view AND target.type = 'integer';
+END;
+
+CREATE TRIGGER IF NOT EXISTS links_update AFTER UPDATE ON objects_latest
+BEGIN
+    DELETE FROM links WHERE src = old.object_id;
+    INSERT OR IGNORE INTO links(src, dst, field)
+    SELECT new.object_id, target.value, reference_fields.field
+    FROM reference_fields, json_each(new.data, '$.' || reference_fields.field) AS target
+    WHERE reference_fields.view = new.view AND target.type = 'integer';
+END;
+
+CREATE TRIGGER IF NOT EXISTS links_delete AFTER DELETE ON objects_latest
+BEGIN
+    DELETE FROM links WHERE src = old.object_id;
+END;
+
+-- compression dictionaries; the newest one of a view is used for writing,
+-- an algorithm of null means plain JSON
+CREATE TABLE IF NOT EXISTS dictionaries (
+    id integer primary key,
+    view int REFERENCES views,
+    algorithm text,
+    data blob not null
+);
@@ -0,0 +1,79 @@
+"""Deltas between JSON values.
+
+`diff(new, old)` returns a JSON-serialisable delta such that
+`patch(new, delta) == old`. Dicts are diffed key by key and long strings
+by difflib opcodes, so small edits of large pages give small deltas.
+
+>>> new = {"title": "Home", "text": "Hello brave new world " * 10}
+>>> old = {"text": "Hello brave old world " * 10, "author": "me"}
+>>> patch(new, diff(new, old)) == old
+True
+>>> diff(new, new)
+{'d': {}}
+"""
+import re
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Union
+
+min_string_diff = 64  # shorter strings are simply replaced
+
+
+def _common_prefix(a: str, b: str) -> int:
+    # binary search, comparing slices is much faster than a loop over chars
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _diff_string(new: str, old: str) -> List[Union[str, List[int]]]:
+    # edits are usually local: strip the common prefix and suffix, then diff
+    # the rest word by word (difflib is far too slow on characters)
+    start = _common_prefix(new, old)
+    end = _common_prefix(new[start:][::-1], old[start:][::-1])
+    new_tokens = re.findall(r"\s+|\S+", new[start : len(new) - end])
+    old_tokens = re.findall(r"\s+|\S+", old[start : len(old) - end])
+    offsets = [start]
+    for token in new_tokens:
+        offsets.append(offsets[-1] + len(token))
+    ops = [[0, start]] if start else []  # type: List[Union[str, List[int]]]
+    for tag, i1, i2, j1, j2 in SequenceMatcher(
+        None, new_tokens, old_tokens
+    ).get_opcodes():
+        if tag == "equal":
+            ops.append([offsets[i1], offsets[i2]])
+        elif j2 > j1:
+            ops.append("".join(old_tokens[j1:j2]))
+    if end:
+        ops.append([len(new) - end, len(new)])
+    return ops
+
+
+def diff(new: Any, old: Any) -> Dict[str, Any]:
+    if isinstance(new, dict) and isinstance(old, dict):
+        changed = {k: diff(new[k], v) for k, v in old.items() if k in new and new[k] != v}
+        changed.update({k: {"v": v} for k, v in old.items() if k not in new})
+        removed = [k for k in new if k not in old]
+        return dict(d=changed, r=removed) if removed else dict(d=changed)
+    if (
+        isinstance(new, str)
+        and isinstance(old, str)
+        and min(len(new), len(old)) >= min_string_diff
+    ):
+        return dict(s=_diff_string(new, old))
+    return dict(v=old)
+
+
+def patch(new: Any, delta: Dict[str, Any]) -> Any:
+    if "d" in delta:
+        old = {k: v for k, v in new.items() if k not in delta.get("r", ())}
+        for k, d in delta["d"].items():
+            old[k] = patch(new.get(k), d)
+        return old
+    if "s" in delta:
+        return "".join(op if isinstance(op, str) else new[op[0] : op[1]] for op in delta["s"])
+    return delta["v"]
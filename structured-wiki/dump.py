@@ -0,0 +1,114 @@
+"""Export and import the object store as NDJSON, one object version per line:
+
+{"object_id": 1, "version": 1700000000000, "view": "person", "data": {...}}
+
+    python dump.py export > latest.ndjson
+    python dump.py export --all-versions -o backup.ndjson
+    python dump.py import backup.ndjson
+    python dump.py import --validate backup.ndjson  # skip objects not matching their type
+    python dump.py import --coerce backup.ndjson  # ...and save them as their type reads them
+"""
+import json
+import sys
+from argparse import ArgumentParser
+from itertools import islice
+import main
+import typedefs
+
+
+def export(out, all_versions=False):
+    rows = main.iter_versions() if all_versions else main.iter_latest()
+    count = 0
+    for object_id, version, view, data in rows:
+        out.write(
+            json.dumps(dict(object_id=object_id, version=version, view=view, data=data))
+        )
+        out.write("\n")
+        count += 1
+    return count
+
+
+def validated(chunk, rejected, coerce=False):
+    """Items of `chunk` that match the type definition of their view, invalid
+    ones are appended to `rejected` with their error. The data is kept as it
+    is, or with `coerce` replaced by the validator's output, which drops
+    undeclared fields and normalizes values.
+    """
+    by_view = {}
+    for item in chunk:
+        by_view.setdefault(item[1], []).append(item)
+    result = []
+    for view, items in by_view.items():
+        valid, errors = typedefs.validate_many(view, [item[2] for item in items])
+        invalid = {i for i, _ in errors}
+        rejected.extend((items[i], e) for i, e in errors)
+        items = [item for i, item in enumerate(items) if i not in invalid]
+        if coerce:
+            items = [(o, v, data, ver) for (o, v, _, ver), data in zip(items, valid)]
+        result += items
+    return result
+
+
+def import_(lines, batch=10000, validate=False, rejected=None, coerce=False):
+    """Save the NDJSON `lines`, one transaction per `batch` lines. Versions
+    already in the store are skipped, so an interrupted import can be rerun.
+    With `validate`, objects not matching the type definition of their view
+    are skipped and appended to the `rejected` list with their error. With
+    `coerce` they are also saved as coerced by the type definition.
+    """
+    views = set()
+    count = 0
+    records = (json.loads(line) for line in lines if line.strip())
+    while True:
+        chunk = [
+            (r["object_id"], r["view"], r["data"], r["version"])
+            for r in islice(records, batch)
+        ]
+        if not chunk:
+            return count
+        if validate or coerce:
+            chunk = validated(chunk, rejected if rejected is not None else [], coerce)
+        for view in {item[1] for item in chunk} - views:
+            main.create_view(view)
+            views.add(view)
+        # newest first: older versions then fail the objects_latest trigger's
+        # version check instead of rewriting objects_latest and the search index
+        chunk.sort(key=lambda item: item[3], reverse=True)
+        main.save_many(chunk, ignore_existing=True)
+        count += len(chunk)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="NDJSON export/import of the object store")
+    parser.add_argument("--database", default="database.db")
+    parser.add_argument("--shards", type=int, default=1, help="database files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    exporter = commands.add_parser("export", help="write objects as NDJSON")
+    exporter.add_argument("--all-versions", action="store_true")
+    exporter.add_argument("-o", "--output", help="file to write, default stdout")
+    importer = commands.add_parser("import", help="read objects from NDJSON")
+    importer.add_argument("input", nargs="?", help="file to read, default stdin")
+    importer.add_argument("--batch", type=int, default=10000)
+    importer.add_argument(
+        "--validate", action="store_true", help="check objects against their type"
+    )
+    importer.add_argument(
+        "--coerce",
+        action="store_true",
+        help="validate, and save objects as coerced by their type",
+    )
+    args = parser.parse_args()
+
+    main.open_store(args.database, args.shards)
+    if args.command == "export":
+        out = open(args.output, "w") if args.output else sys.stdout
+        with out:
+            count = export(out, args.all_versions)
+    else:
+        lines = open(args.input, "r") if args.input else sys.stdin
+        with lines:
+            rejected = []
+            count = import_(lines, args.batch, args.validate, rejected, args.coerce)
+        for (object_id, view, _, version), error in rejected:
+            print(f"skipped {view} {object_id} @ {version}: {error}", file=sys.stderr)
+    print(f"{args.command}ed {count} objects", file=sys.stderr)
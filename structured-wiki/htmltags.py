@@ -1,4 +1,4 @@
-from typing import Iterable, Union
+from typing import Iterable, List, Union
 from html import escape
 
 HTMLContent = Union["HTMLElement", str]
@@ -70,8 +70,27 @@ class HTMLElement(object):
         if is_doc_root:
             yield "\n"
 
+    def render_chunks(self, chunk_size: int = 32 * 1024) -> Iterable[str]:
+        """Render in strings of at least `chunk_size` characters (except the
+        last), servers handle a few large chunks much faster than many tiny.
+        >>> [len(c) for c in ul(*[li(str(i)) for i in range(1000)]).render_chunks(4096)]
+        [4097, 4096, 4098, 609]
+        """
+        buffer = []  # type: List[str]
+        size = 0
+        for s in self.lazy_render():
+            buffer.append(s)
+            size += len(s)
+            if size >= chunk_size:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield "".join(buffer)
+
     def __iter__(self):
-        yield from self.lazy_render()
+        # bottle sends each item of an iterable response as a chunk
+        yield from self.render_chunks()
 
     def __str__(self) -> str:
         """Render element to string.
@@ -1,36 +1,917 @@
+from collections import defaultdict
 from datetime import datetime
+from pathlib import Path
+import base64
+import heapq
 import time
-import sqlite3
 import json
+import re
+import threading
+import codec
+import delta
+import typedefs
+from changes import ChangeLog
+from lru import LRUCache
+from pool import Pool
 
-c = sqlite3.connect("database.db")
-with open("database_setup.sql", "r") as f:
-    c.executescript(f.read())
-c.commit()
+pool = Pool("database.db")  # holds the views catalog, and is shard 0
+shards = [pool]
+view_ids = LRUCache(1024)
+latest = LRUCache(10000)
+views_by_id = {}  # view id -> (name, shard index), rows never change
+changes = ChangeLog(10000)  # saves made by this process
+
+
+def open_store(path="database.db", shard_count=1, **pool_args):
+    """Use the database at `path`, with the objects of each view in one of
+    `shard_count` files (path, then path.1, path.2, ... before the suffix)
+    so that writes to views in different shards do not share a lock. Views
+    keep the shard they were created in, so the count may grow later.
+    """
+    global pool, shards
+    replaced = shards
+    shards = [Pool(p, **pool_args) for p in _shard_paths(path, shard_count)]
+    pool = shards[0]
+    for p in replaced:  # connections still borrowed are closed when returned
+        p.close()
+    view_ids.clear()
+    latest.clear()
+    views_by_id.clear()
+    dictionaries.clear()
+    write_codecs.clear()
+
+
+def _shard_paths(path, shard_count):
+    p = Path(path)
+    return [path] + [
+        str(p.with_name(f"{p.stem}.{i}{p.suffix}")) for i in range(1, shard_count)
+    ]
+
+
+def snapshot(path):
+    """Copy a consistent state of every shard to files named like those of
+    open_store(path, ...), for readers of open_snapshot(path, ...).
+    """
+    for p, target in zip(shards, _shard_paths(path, len(shards))):
+        p.backup(target)
+
+
+def open_snapshot(path, shard_count=1, mmap_size=256 * 2**20, **pool_args):
+    """Serve reads from files written by snapshot(), for processes that
+    only render pages: nothing is locked, pages are memory-mapped, and
+    writes fail. Call it again to switch to a newer snapshot.
+    """
+    open_store(path, shard_count, mmap_size=mmap_size, immutable=True, **pool_args)
+
+
+class UnknownViewError(LookupError):
+    """Raised for names of views that were never created."""
 
 
 def create_view(view_name):
-    c.execute("insert or ignore into views values (?)", (view_name,))
+    with pool.write() as c:
+        # round robin over the shards
+        c.execute(
+            "insert or ignore into views(name, shard) "
+            "values (?, (select count(*) from views) % ?)",
+            (view_name.lower(), len(shards)),
+        )
 
 
 def get_view_id(view_name):
-    return c.execute(
-        "select rowid from views where name=?", (view_name.lower(),)
-    ).fetchone()[0]
+    view_name = view_name.lower()
+    view_id = view_ids.get(view_name)
+    if view_id is None:
+        with pool.read() as c:
+            row = c.execute(
+                "select rowid, coalesce(shard, 0) from views where name=?", (view_name,)
+            ).fetchone()
+        if row is None:
+            raise UnknownViewError(f"unknown view {view_name!r}")
+        view_id, shard = row
+        views_by_id[view_id] = (view_name, shard)
+        view_ids.put(view_name, view_id)
+    return view_id
+
+
+def _view(view_id):
+    if view_id not in views_by_id:
+        with pool.read() as c:
+            for view_id_, name, shard in c.execute(
+                "select rowid, name, coalesce(shard, 0) from views"
+            ):
+                views_by_id[view_id_] = (name, shard)
+    return views_by_id[view_id]
+
+
+def view_name(view_id):
+    return _view(view_id)[0]
+
+
+def shard_of(view_id):
+    """The pool that stores the objects of a view."""
+    return shards[_view(view_id)[1]]
+
+
+def _decode(row):
+    return row and (row[0], row[1], row[2], json.loads(row[3]))
 
 
 def save(object_id, view, data):
+    save_many([(object_id, view, data, None)])
+
+
+def save_many(items, ignore_existing=False):
+    """Save (object_id, view, data, version) items in one transaction per
+    shard. A version of None means now, or one past the object's newest
+    stored or already assigned version if that is later. Existing
+    (object_id, version) pairs are an error unless `ignore_existing` is
+    set. If a shard fails, the exception gets a `saved` attribute with the
+    indexes of the items that were committed in other shards before.
+    """
+    rows = []
+    fresh = []
+    for object_id, view, data, version in items:
+        fresh.append(version is None)
+        rows.append([object_id, version, get_view_id(view), json.dumps(data)])
+    by_shard = defaultdict(list)
+    indexes = defaultdict(list)
+    for i, (is_fresh, row) in enumerate(zip(fresh, rows)):
+        by_shard[shard_of(row[2])].append((is_fresh, row))
+        indexes[shard_of(row[2])].append(i)
+    verb = "insert or ignore" if ignore_existing else "insert"
+    insert = f"{verb} into objects(object_id, version, view, data) values (?, ?, ?, ?);"
+    # one transaction per shard, items in other shards are not rolled back
+    saved = []
+    for p, shard_rows in by_shard.items():
+        try:
+            with p.write() as c:
+                _assign_versions(c, shard_rows)
+                if any(_write_codec(p, c, row[2]) for _, row in shard_rows):
+                    for _, row in shard_rows:
+                        c.execute(insert, row)
+                        _compress_new(p, c, row)
+                else:
+                    c.executemany(insert, [row for _, row in shard_rows])
+                # still holding the write lock, so concurrent saves cache in
+                # commit order; rows older than the stored latest are not cached
+                stored = dict(
+                    c.execute(
+                        "select object_id, version from objects_latest "
+                        "where object_id in (select value from json_each(?))",
+                        (json.dumps([row[0] for _, row in shard_rows]),),
+                    )
+                )
+                for _, row in shard_rows:
+                    if stored.get(row[0]) == row[1]:
+                        latest.put(row[0], _decode(row))
+                    else:
+                        latest.pop(row[0])
+        except Exception as e:
+            for _, row in shard_rows:
+                latest.pop(row[0])
+            e.saved = sorted(saved)
+            raise
+        saved += indexes[p]
+        if len(shards) > 1:
+            _drop_moved(p, [row for _, row in shard_rows])
+        # after the commit, so that readers notified of a change can see it
+        changes.append(
+            *(
+                dict(object_id=row[0], version=row[1], view=view_name(row[2]))
+                for _, row in shard_rows
+            )
+        )
+
+
+def _assign_versions(c, shard_rows):
+    # under the write lock, so that concurrent and repeated saves of an
+    # object get increasing versions without stamping any in the future
+    now = int(time.time() * 1000)
+    last = {}
+    for is_fresh, row in shard_rows:
+        if not is_fresh:
+            last[row[0]] = max(row[1], last.get(row[0], row[1]))
+    object_ids = list({row[0] for is_fresh, row in shard_rows if is_fresh})
+    if not object_ids:
+        return
+    for object_id, stored in c.execute(
+        "select value, (select max(version) from objects where object_id=value) "
+        "from json_each(?)",
+        (json.dumps(object_ids),),
+    ):
+        if stored is not None:
+            last[object_id] = max(stored, last.get(object_id, stored))
+    for is_fresh, row in shard_rows:
+        if is_fresh:
+            row[1] = max(now, last[row[0]] + 1) if row[0] in last else now
+            last[row[0]] = row[1]
+
+
+def _drop_moved(p, rows, chunk_size=500):
+    # an object that moved to a view of another shard leaves its
+    # objects_latest row (and search index and links) behind; keep only the
+    # row of the newest version among the shards
+    newest = {}
+    for object_id, version, _, _ in rows:
+        newest[object_id] = max(version, newest.get(object_id, version))
+    object_ids = list(newest)
+    for q in shards:
+        if q is p:
+            continue
+        found = []
+        for start in range(0, len(object_ids), chunk_size):
+            chunk = object_ids[start : start + chunk_size]
+            with q.read() as c:
+                found += c.execute(
+                    "select object_id, version from objects_latest "
+                    f"where object_id in ({','.join('?' * len(chunk))});",
+                    chunk,
+                ).fetchall()
+        older = [(i, newest[i]) for i, version in found if version < newest[i]]
+        newer = [(i, version) for i, version in found if version > newest[i]]
+        for target, stale in ((q, older), (p, newer)):
+            if stale:
+                with target.write() as c:
+                    c.executemany(
+                        "delete from objects_latest where object_id=? and version<?;", stale
+                    )
+        for object_id, _ in newer:
+            latest.pop(object_id)
+
+
+dictionaries = {}  # (shard path, dictionary id) -> (algorithm, data), rows never change
+write_codecs = {}  # view id -> (encoding, algorithm, dictionary) or None
+
+
+def _dictionary(p, c, dictionary_id):
+    key = (p.path, dictionary_id)
+    d = dictionaries.get(key)
+    if d is None:
+        d = dictionaries[key] = c.execute(
+            "select algorithm, data from dictionaries where id=?", (dictionary_id,)
+        ).fetchone()
+    return d
+
+
+def _write_codec(p, c, view_id):
+    if view_id not in write_codecs:
+        row = c.execute(
+            "select id, algorithm, data from dictionaries where view=? order by id desc limit 1",
+            (view_id,),
+        ).fetchone()
+        write_codecs[view_id] = row and row[1] and (f"{row[1]}:{row[0]}", row[1], row[2])
+    return write_codecs[view_id]
+
+
+def _pack(p, c, view_id, payload, is_delta):
+    """(encoding, payload) of an objects row storing the JSON text `payload`."""
+    stages = ["delta"] if is_delta else []
+    write_codec = _write_codec(p, c, view_id)
+    if write_codec:
+        encoding, algorithm, dictionary = write_codec
+        payload = codec.compress(algorithm, dictionary, payload.encode())
+        stages.append(encoding)
+    return ",".join(stages) or None, payload
+
+
+def _unpack(p, c, encoding, payload):
+    """(is delta, JSON value) of an objects row in shard `p`."""
+    stages = encoding.split(",") if encoding else []
+    if stages and stages[-1] != "delta":
+        algorithm, dictionary = _dictionary(p, c, int(stages.pop().split(":")[1]))
+        payload = codec.decompress(algorithm, dictionary, payload)
+    return bool(stages), json.loads(payload)
+
+
+def _compress_new(p, c, row):
+    # rows are inserted as plain JSON so that the objects_latest trigger
+    # copies plain JSON, and compressed right away so that the next insert
+    # reuses the space freed in the page
+    object_id, version, view_id, payload = row
+    if _write_codec(p, c, view_id):
+        c.execute(
+            "update objects set encoding=?, data=? "
+            "where object_id=? and version=? and encoding is null and data=?",
+            (*_pack(p, c, view_id, payload, False), object_id, version, payload),
+        )
+
+
+def set_codec(view, algorithm="zlib", samples=1000):
+    """Compress payloads of `view` saved from now on (and history rewritten by
+    compact()) with a dictionary trained on up to `samples` latest objects
+    of the view. An algorithm of None stores plain JSON again.
+    """
     view_id = get_view_id(view)
-    c.execute(
-        "insert into objects values (?, ?, ?, ?);",
-        (object_id, int(time.time() * 1000), view_id, json.dumps(data)),
-    )
+    p = shard_of(view_id)
+    dictionary = b""
+    if algorithm is not None:
+        with p.read() as c:
+            rows = c.execute(
+                "select data from objects_latest where view=? order by random() limit ?",
+                (view_id, samples),
+            ).fetchall()
+        dictionary = codec.train(algorithm, [row[0].encode() for row in rows])
+    with p.write() as c:
+        c.execute(
+            "insert into dictionaries(view, algorithm, data) values (?, ?, ?)",
+            (view_id, algorithm, dictionary),
+        )
+        write_codecs.pop(view_id, None)
 
 
 def get_latest(object_id):
-    return c.execute(
-        "select * from objects where object_id=? order by version desc;", (object_id,)
-    ).fetchone()
+    """Latest (object_id, version, view, data) with decoded data. The result
+    may be shared with the cache, so callers must not mutate it.
+    """
+    row = latest.get(object_id)
+    if row is None:
+        # an object that moved between views can be in several shards
+        for p in shards:
+            with p.read() as c:
+                found = c.execute(
+                    "select object_id, version, view, data from objects_latest where object_id=?;",
+                    (object_id,),
+                ).fetchone()
+            if found is not None and (row is None or found[1] > row[1]):
+                row = found
+        if row is not None:
+            row = latest.setdefault(object_id, _decode(row))
+    return row
+
+
+def get_latest_many(object_ids, chunk_size=500):
+    """Dict of object_id -> get_latest(object_id) for the ids that exist,
+    reading the uncached ones with one query per shard and `chunk_size` ids.
+    """
+    rows = {}
+    missing = []
+    for object_id in set(object_ids):
+        row = latest.get(object_id)
+        if row is None:
+            missing.append(object_id)
+        else:
+            rows[object_id] = row
+    found = {}
+    for p in shards:
+        for start in range(0, len(missing), chunk_size):
+            chunk = missing[start : start + chunk_size]
+            with p.read() as c:
+                for row in c.execute(
+                    "select object_id, version, view, data from objects_latest "
+                    f"where object_id in ({','.join('?' * len(chunk))});",
+                    chunk,
+                ):
+                    if row[0] not in found or row[1] > found[row[0]][1]:
+                        found[row[0]] = row
+    for object_id, row in found.items():
+        rows[object_id] = latest.setdefault(object_id, _decode(row))
+    return rows
+
+
+def list_latest(view):
+    view_id = get_view_id(view)
+    with shard_of(view_id).read() as c:
+        rows = c.execute(
+            "select object_id, version, view, data from objects_latest where view=? order by object_id;",
+            (view_id,),
+        ).fetchall()
+    return [_decode(row) for row in rows]
+
+
+def encode_cursor(view_id, object_id):
+    text = json.dumps([view_id, object_id]).encode()
+    return base64.urlsafe_b64encode(text).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(view id, last object id) of a cursor token, ValueError if malformed."""
+    try:
+        text = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        view_id, object_id = json.loads(text)
+    except Exception as e:
+        raise ValueError(f"invalid cursor {cursor!r}") from e
+    if not isinstance(view_id, int) or not isinstance(object_id, int):
+        raise ValueError(f"invalid cursor {cursor!r}")
+    return view_id, object_id
+
+
+def list_page(view, cursor=None, limit=50):
+    """Return (rows, next cursor) for the next `limit` latest objects of
+    `view` in object_id order, starting after `cursor` (None for the first
+    page). The next cursor is None after the last page. Pages seek on the
+    (view, object_id) index, so deep pages cost the same as the first.
+    """
+    view_id = get_view_id(view)
+    last = -(2**63)
+    if cursor is not None:
+        cursor_view_id, last = decode_cursor(cursor)
+        if cursor_view_id != view_id:
+            raise ValueError(f"cursor {cursor!r} is not for view {view!r}")
+    with shard_of(view_id).read() as c:
+        rows = c.execute(
+            "select object_id, version, view, data from objects_latest "
+            "where view=? and object_id>? order by object_id limit ?;",
+            (view_id, last, limit + 1),
+        ).fetchall()
+    more = len(rows) > limit
+    rows = [_decode(row) for row in rows[:limit]]
+    return rows, encode_cursor(view_id, rows[-1][0]) if more else None
+
+
+_field_name = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def _field_expression(field):
+    # must be spelled exactly like this in queries for the index to be used
+    if not _field_name.match(field):
+        raise ValueError(f"Unsupported field name {field!r}")
+    return f"json_extract(data, '$.{field}')"
+
+
+def _field_index(field):
+    return f"objects_latest_field_{field}"
+
+
+def define_type(view, definition=None):
+    """Register `view` with the fields of its type definition (read from
+    type_definitions/ if not given) and maintain one expression index on
+    objects_latest per declared field. Indexes no longer used by any view
+    are dropped. Links are extracted from fields of type "reference".
+    """
+    if definition is None:
+        definition = typedefs.load(view)
+    fields = typedefs.field_names(definition)
+    references = typedefs.field_names(definition, "reference")
+    expressions = [_field_expression(field) for field in fields]
+    create_view(view)
+    view_id = get_view_id(view)
+    with shard_of(view_id).write() as c:
+        c.execute("delete from indexed_fields where view=?", (view_id,))
+        c.executemany(
+            "insert into indexed_fields values (?, ?)",
+            [(view_id, field) for field in fields],
+        )
+        for field, expression in zip(fields, expressions):
+            c.execute(
+                f'create index if not exists "{_field_index(field)}" '
+                f"on objects_latest(view, {expression})"
+            )
+        used = {row[0] for row in c.execute("select field from indexed_fields")}
+        for (name,) in c.execute(
+            "select name from sqlite_master where type='index' and name like ?",
+            (_field_index("%"),),
+        ).fetchall():
+            if name[len(_field_index("")) :] not in used:
+                c.execute(f'drop index "{name}"')
+        current = c.execute(
+            "select field from reference_fields where view=?", (view_id,)
+        ).fetchall()
+        if {row[0] for row in current} != set(references):
+            c.execute("delete from reference_fields where view=?", (view_id,))
+            c.executemany(
+                "insert into reference_fields values (?, ?)",
+                [(view_id, field) for field in references],
+            )
+            # the triggers only see objects saved from now on
+            c.execute(
+                "delete from links where src in "
+                "(select object_id from objects_latest where view=?)",
+                (view_id,),
+            )
+            c.execute(
+                "insert or ignore into links(src, dst, field) "
+                "select object_id, target.value, reference_fields.field "
+                "from objects_latest join reference_fields using (view), "
+                "json_each(data, '$.' || reference_fields.field) as target "
+                "where view=? and target.type='integer'",
+                (view_id,),
+            )
+
+
+def find(view, **fields):
+    """Latest objects of `view` whose fields equal the given values."""
+    view_id = get_view_id(view)
+    where = "".join(f" and {_field_expression(field)}=?" for field in fields)
+    with shard_of(view_id).read() as c:
+        rows = c.execute(
+            "select object_id, version, view, data from objects_latest where view=?"
+            + where,
+            (view_id, *fields.values()),
+        ).fetchall()
+    return [_decode(row) for row in rows]
+
+
+def links_from(object_id):
+    """(field, object_id) of the objects the latest version links to."""
+    links = []
+    for p in shards:
+        with p.read() as c:
+            links += c.execute(
+                "select field, dst from links where src=? order by field, dst", (object_id,)
+            ).fetchall()
+    return links
+
+
+def backlinks(object_id, field=None):
+    """(object_id, field) of the objects whose latest version links here,
+    optionally only through `field`.
+    """
+    where = " and field=?" if field is not None else ""
+    args = (object_id, field) if field is not None else (object_id,)
+    links = []
+    for p in shards:
+        with p.read() as c:
+            links += c.execute(
+                "select src, field from links where dst=?" + where, args
+            ).fetchall()
+    return sorted(links)
+
+
+def _reachable(p, distances, depth, backwards):
+    # breadth first search from objects at known distances, in one query
+    near, far = ("dst", "src") if backwards else ("src", "dst")
+    with p.read() as c:
+        return c.execute(
+            "with recursive reach(object_id, depth) as ("
+            "select cast(key as integer), value from json_each(?1) "
+            f"union select links.{far}, reach.depth + 1 from reach "
+            f"join links on links.{near} = reach.object_id where reach.depth < ?2) "
+            "select object_id, min(depth) from reach group by object_id",
+            (json.dumps({str(k): v for k, v in distances.items()}), depth),
+        ).fetchall()
+
+
+def linked(object_id, depth=2, backwards=False):
+    """(object_id, distance) of the objects reachable from `object_id` by
+    following at most `depth` links (towards their sources if `backwards`),
+    ordered by distance and object_id.
+    """
+    distances = {object_id: 0}
+    if len(shards) == 1:
+        distances.update(_reachable(pool, distances, depth, backwards))
+    else:
+        # the links of a path may be in different shards, go level by level
+        frontier = {object_id: 0}
+        for level in range(1, depth + 1):
+            found = {}
+            for p in shards:
+                for o, d in _reachable(p, frontier, level, backwards):
+                    if o not in distances:
+                        found[o] = min(d, found.get(o, d))
+            distances.update(found)
+            frontier = found
+            if not frontier:
+                break
+    del distances[object_id]
+    return sorted(distances.items(), key=lambda item: (item[1], item[0]))
+
+
+snippet_start, snippet_end = "\x02", "\x03"
+
+
+def search_query(text):
+    """FTS5 query matching every word of `text`. The last word is the one
+    still being typed, so it matches as a prefix once it is long enough to
+    be selective; shorter prefixes would rank huge result sets.
+    """
+    words = ['"' + word.replace('"', '""') + '"' for word in text.split()]
+    if words and len(text.split()[-1]) >= 3 and not text[-1].isspace():
+        words[-1] += "*"
+    return " ".join(words)
+
+
+def search(text, view=None, limit=20):
+    """Ranked (object_id, view name, snippet) for objects whose latest version
+    contains all words of `text`. Matches in the snippet are enclosed in
+    `snippet_start` and `snippet_end`.
+    """
+    query = search_query(text)
+    if not query:
+        return []
+    where = " and view=?" if view is not None else ""
+    args = (query, get_view_id(view)) if view is not None else (query,)
+    hits = []
+    for p in [shard_of(args[1])] if view is not None else shards:
+        with p.read() as c:
+            hits += c.execute(
+                "select rank, rowid, view, snippet(objects_fts, 1, ?, ?, '…', 12) "
+                "from objects_fts where objects_fts match ?" + where + " order by rank limit ?",
+                (snippet_start, snippet_end, *args, limit),
+            ).fetchall()
+    # bm25 ranks of different shards are only roughly comparable
+    return [
+        (object_id, view_name(view_id), snippet)
+        for _, object_id, view_id, snippet in heapq.nsmallest(limit, hits)
+    ]
+
+
+max_delta_chain = 16
+
+
+def get_version(object_id, version):
+    """Data of `object_id` as saved at `version`, or None. Compacted history
+    rows are rebuilt from the next full snapshot by undoing deltas.
+    """
+    for p in shards:
+        data = _get_version(p, object_id, version)
+        if data is not None:
+            return data
+    return None
+
+
+def _get_version(p, object_id, version):
+    deltas = []
+    with p.read() as c:
+        while True:
+            row = c.execute(
+                "select encoding, data from objects where object_id=? and version=?",
+                (object_id, version),
+            ).fetchone()
+            if row is None:
+                return None
+            is_delta, stored = _unpack(p, c, *row)
+            if not is_delta:
+                break
+            deltas.append(stored["delta"])
+            version = stored["base"]
+    data = stored
+    for d in reversed(deltas):
+        data = delta.patch(data, d)
+    return data
+
+
+def iter_latest(batch=1000):
+    """Yield the latest (object_id, version, view name, data) of all objects,
+    shard by shard in object_id order, reading `batch` rows at a time.
+    """
+    for p in shards:
+        last = -(2**63)
+        while True:
+            with p.read() as c:
+                rows = c.execute(
+                    "select object_id, version, view, data from objects_latest "
+                    "where object_id>? order by object_id limit ?",
+                    (last, batch),
+                ).fetchall()
+            if not rows:
+                break
+            for object_id, version, view_id, data in rows:
+                yield object_id, version, view_name(view_id), json.loads(data)
+            last = rows[-1][0]
+
+
+def iter_versions(batch=1000):
+    """Yield (object_id, version, view name, data) of every saved version,
+    shard by shard and newest first per object, reading `batch` rows at a
+    time.
+    """
+    for p in shards:
+        last = (-(2**63), 0)
+        newer = (None, None, None)  # (object_id, version, data) of the previous row
+        while True:
+            with p.read() as c:
+                rows = [
+                    (object_id, version, view_id, *_unpack(p, c, encoding, payload))
+                    for object_id, version, view_id, encoding, payload in c.execute(
+                        "select object_id, version, view, encoding, data from objects "
+                        "where object_id>?1 or (object_id=?1 and version<?2) "
+                        "order by object_id, version desc limit ?3",
+                        (*last, batch),
+                    )
+                ]
+            if not rows:
+                break
+            for object_id, version, view_id, is_delta, stored in rows:
+                if not is_delta:
+                    data = stored
+                elif newer[:2] == (object_id, stored["base"]):
+                    data = delta.patch(newer[2], stored["delta"])
+                else:
+                    data = _get_version(p, object_id, version)
+                newer = (object_id, version, data)
+                yield object_id, version, view_name(view_id), data
+            last = rows[-1][:2]
+
+
+def get_at(object_id, timestamp):
+    """(object_id, version, view, data) of the version current at
+    `timestamp` (ms since the epoch), or None.
+    """
+    found = None
+    for p in shards:
+        with p.read() as c:
+            row = c.execute(
+                "select object_id, version, view from objects where object_id=? and version<=? "
+                "order by version desc limit 1",
+                (object_id, timestamp),
+            ).fetchone()
+        if row is not None and (found is None or row[1] > found[0][1]):
+            found = (row, p)
+    return found and (*found[0], _get_version(found[1], object_id, found[0][1]))
+
+
+def _states(p, object_ids, timestamp):
+    # version current at timestamp for each object, found by primary key seeks
+    with p.read() as c:
+        rows = [
+            (object_id, version, view, *_unpack(p, c, encoding, payload))
+            for object_id, version, view, encoding, payload in c.execute(
+                "with m(object_id, version) as (select value, (select max(version) from objects"
+                " where object_id=value and version<=?) from json_each(?))"
+                " select o.object_id, o.version, o.view, o.encoding, o.data from m"
+                " join objects o on o.object_id=m.object_id and o.version=m.version",
+                (timestamp, json.dumps(object_ids)),
+            )
+        ]
+    # rebuild deltas outside of the read so that get_version can borrow a connection
+    return {
+        object_id: (
+            object_id,
+            version,
+            view,
+            _get_version(p, object_id, version) if is_delta else stored,
+        )
+        for object_id, version, view, is_delta, stored in rows
+    }
+
+
+def _current_states(p, object_ids, timestamp):
+    # _states() without the objects that were in a view of another shard then
+    states = _states(p, object_ids, timestamp)
+    for q in shards:
+        if q is p or not states:
+            continue
+        with q.read() as c:
+            elsewhere = c.execute(
+                "select value, (select max(version) from objects"
+                " where object_id=value and version<=?) from json_each(?)",
+                (timestamp, json.dumps(list(states))),
+            ).fetchall()
+        for object_id, version in elsewhere:
+            if version is not None and version > states[object_id][1]:
+                del states[object_id]
+    return states
+
+
+def as_of(view, timestamp, batch=500):
+    """Yield (object_id, version, view, data) for every object that belonged
+    to `view` at `timestamp` (ms since the epoch), ordered by object_id.
+    """
+    view_id = get_view_id(view)
+    p = shard_of(view_id)
+    last = -(2**63)
+    while True:
+        with p.read() as c:
+            # loose index scan: one seek per distinct object in the view
+            object_ids = [
+                row[0]
+                for row in c.execute(
+                    "with recursive ids(object_id) as ("
+                    " select min(object_id) from objects where view=?1 and object_id>?2"
+                    " union all select (select min(object_id) from objects"
+                    " where view=?1 and object_id>ids.object_id)"
+                    " from ids where ids.object_id is not null limit ?3"
+                    ") select object_id from ids where object_id is not null",
+                    (view_id, last, batch),
+                )
+            ]
+        if not object_ids:
+            return
+        states = _current_states(p, object_ids, timestamp)
+        for object_id in object_ids:
+            state = states.get(object_id)
+            if state is not None and state[2] == view_id:
+                yield state
+        last = object_ids[-1]
+
+
+def diff_between(view, start, end, batch=500):
+    """Yield (object_id, before, after) for the objects of `view` saved after
+    `start` and up to `end`, where before and after are the states as
+    returned by as_of() or None where the object was not in `view`.
+    """
+    view_id = get_view_id(view)
+    p = shard_of(view_id)
+    object_ids = set()
+    for q in shards:  # objects that left the view were saved in another shard
+        with q.read() as c:
+            object_ids.update(
+                row[0]
+                for row in c.execute(
+                    "select distinct object_id from objects where version>? and version<=?",
+                    (start, end),
+                )
+            )
+    object_ids = sorted(object_ids)
+    for i in range(0, len(object_ids), batch):
+        chunk = object_ids[i : i + batch]
+        before, after = _current_states(p, chunk, start), _current_states(p, chunk, end)
+        for object_id in chunk:
+            b, a = before.get(object_id), after.get(object_id)
+            b = b if b is not None and b[2] == view_id else None
+            a = a if a is not None and a[2] == view_id else None
+            if (b and b[3]) != (a and a[3]):
+                yield object_id, b, a
+
+
+def compact_object(object_id, max_chain=max_delta_chain):
+    """Store the history of `object_id` as deltas against the next newer
+    version, keeping every (max_chain + 1)th version and the latest one in
+    full so that no read has to undo more than `max_chain` deltas.
+    """
+    for p in shards:
+        _compact_object(p, object_id, max_chain)
+
+
+def _compact_object(p, object_id, max_chain):
+    # the history of an object that moved between views may span shards,
+    # each shard keeps its part self-contained
+    with p.write() as c:
+        rows = c.execute(
+            "select version, view, encoding, data from objects where object_id=? "
+            "order by version desc",
+            (object_id,),
+        ).fetchall()
+        decoded = {}
+        newer = None
+        run = 0
+        for version, view_id, encoding, payload in rows:
+            is_delta, stored = _unpack(p, c, encoding, payload)
+            if is_delta:
+                data = delta.patch(decoded[stored["base"]], stored["delta"])
+            else:
+                data = stored
+            decoded[version] = data
+            keep_full = newer is None or run >= max_chain
+            run = 0 if keep_full else run + 1
+            write_codec = _write_codec(p, c, view_id)
+            full_encoding = write_codec[0] if write_codec else None
+            delta_encoding = ",".join(filter(None, ["delta", full_encoding]))
+            value = None
+            if keep_full and encoding != full_encoding:
+                value = data
+            elif not keep_full and (encoding != delta_encoding or stored["base"] != newer):
+                value = dict(base=newer, delta=delta.diff(decoded[newer], data))
+            if value is not None:
+                c.execute(
+                    "update objects set encoding=?, data=? where object_id=? and version=?",
+                    (*_pack(p, c, view_id, json.dumps(value), not keep_full), object_id, version),
+                )
+            newer = version
+
+
+def compact(max_chain=max_delta_chain):
+    """Compact the history of every object that has more full versions than
+    its snapshots. Returns the number of objects compacted.
+    """
+    count = 0
+    for p in shards:
+        with p.read() as c:
+            object_ids = [
+                row[0]
+                for row in c.execute(
+                    "select object_id from objects group by object_id "
+                    "having sum(coalesce(encoding, '') not like 'delta%') > 1 + (count(*) - 1) / ?",
+                    (max_chain + 1,),
+                )
+            ]
+        for object_id in object_ids:
+            _compact_object(p, object_id, max_chain)
+        count += len(object_ids)
+    return count
+
+
+def start_compaction(interval=60.0, max_chain=max_delta_chain):
+    """Run compact() every `interval` seconds in a daemon thread until the
+    returned event is set.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            compact(max_chain)
+
+    threading.Thread(target=run, name="compaction", daemon=True).start()
+    return stop
+
+
+def start_snapshots(path, interval=10.0):
+    """Write a snapshot() to `path` every `interval` seconds in a daemon
+    thread until the returned event is set.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            snapshot(path)
+
+    threading.Thread(target=run, name="snapshots", daemon=True).start()
+    return stop
+
+
+def cache_stats():
+    return dict(view_ids=view_ids.stats(), latest=latest.stats())
 
 
 if __name__ == "__main__":
@@ -41,5 +922,10 @@ if __name__ == "__main__":
         save(i, "test_view", dict(a=i, b=str(datetime.now())))
 
     print(get_latest(3))
+    print(list_latest("test_view"))
 
-    c.commit()
+    define_type("person")
+    save(100, "person", dict(firstName="Ada", lastName="Lovelace"))
+    print(find("person", lastName="Lovelace"))
+    print(search("lov"))
+    print(cache_stats())
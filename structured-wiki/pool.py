@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Queue, Empty
+from typing import Iterator
+
+setup_script = Path(__file__).parent / "database_setup.sql"
+
+
+def upgrade(c: sqlite3.Connection) -> None:
+    """Add columns that "create table if not exists" cannot add to databases
+    created by older versions of database_setup.sql.
+    """
+    columns = {row[1] for row in c.execute("pragma table_info(objects)")}
+    if columns and "encoding" not in columns:
+        c.execute("alter table objects add column encoding text")
+    columns = {row[1] for row in c.execute("pragma table_info(views)")}
+    if columns and "shard" not in columns:
+        c.execute("alter table views add column shard int")
+
+
+class Pool(object):
+    """One read-write connection shared by writers (serialised by a lock)
+    plus up to `readers` read-only connections. Nothing is opened before
+    the first request, so creating a pool does not touch the disk.
+
+    An `immutable` pool reads a snapshot written by backup(): SQLite skips
+    locking and change detection, and write() fails. Readers memory-map up
+    to `mmap_size` bytes of the file instead of copying pages into their
+    own cache.
+    """
+
+    def __init__(
+        self,
+        path: str = "database.db",
+        readers: int = 4,
+        cached_statements: int = 256,
+        synchronous: str = "normal",
+        mmap_size: int = 0,
+        immutable: bool = False,
+    ) -> None:
+        self.path = path
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.immutable = immutable
+        self.max_readers = readers
+        self.cached_statements = cached_statements
+        self._writer = None  # type: sqlite3.Connection
+        self._write_lock = threading.RLock()
+        self._readers = Queue()  # type: Queue
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self, uri: str) -> sqlite3.Connection:
+        return sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+
+    def _open_writer(self) -> sqlite3.Connection:
+        with self._write_lock:
+            if self._writer is None:
+                c = self._connect(Path(self.path).resolve().as_uri())
+                c.execute("pragma journal_mode=wal")
+                # "normal" survives application crashes, "full" also power loss
+                c.execute(f"pragma synchronous={self.synchronous}")
+                upgrade(c)
+                with open(setup_script, "r") as f:
+                    c.executescript(f.read())
+                c.commit()
+                self._writer = c
+            return self._writer
+
+    def _open_reader(self) -> sqlite3.Connection:
+        uri = Path(self.path).resolve().as_uri()
+        if self.immutable:
+            c = self._connect(uri + "?mode=ro&immutable=1")
+        else:
+            self._open_writer()  # make sure the schema exists
+            c = self._connect(uri + "?mode=ro")
+        if self.mmap_size:
+            c.execute(f"pragma mmap_size={int(self.mmap_size)}")
+        return c
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """Exclusive use of the writer connection, committed on exit."""
+        if self.immutable:
+            raise sqlite3.OperationalError(f"{self.path} is a read-only snapshot")
+        with self._write_lock:
+            c = self._open_writer()
+            try:
+                with c:
+                    yield c
+            finally:
+                if self._closed:
+                    self._close_writer()
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        """Borrow a read-only connection, blocking while all are in use."""
+        try:
+            c = self._readers.get_nowait()
+        except Empty:
+            c = None
+        while c is None:
+            with self._reader_lock:
+                # a closed pool gets no connections back, so waiters open their own
+                grow = self._closed or self._reader_count < self.max_readers
+                if grow:
+                    self._reader_count += 1
+            if grow:
+                try:
+                    c = self._open_reader()
+                except Exception:
+                    with self._reader_lock:
+                        self._reader_count -= 1
+                    raise
+            else:
+                try:
+                    c = self._readers.get(timeout=0.1)
+                except Empty:
+                    pass
+        try:
+            yield c
+        finally:
+            with self._reader_lock:
+                closed = self._closed
+                if closed:
+                    self._reader_count -= 1
+                else:
+                    self._readers.put(c)
+            if closed:
+                c.close()
+
+    def backup(self, path: str) -> None:
+        """Copy a consistent state of the database to `path` without blocking
+        writers. The copy replaces `path` atomically, so readers of an older
+        copy keep reading it until they reopen.
+        """
+        temporary = f"{path}.tmp"
+        with self.read() as c:
+            target = sqlite3.connect(temporary)
+            try:
+                c.backup(target)
+                # an immutable database must not need a -wal file
+                target.execute("pragma journal_mode=delete")
+            finally:
+                target.close()
+        os.replace(temporary, path)
+
+    def _close_writer(self) -> None:
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def close(self) -> None:
+        """Close the idle connections now and borrowed ones when they are
+        returned, without waiting for them.
+        """
+        with self._reader_lock:
+            self._closed = True
+            idle = []
+            while True:
+                try:
+                    idle.append(self._readers.get_nowait())
+                except Empty:
+                    break
+            self._reader_count -= len(idle)
+        for c in idle:
+            c.close()
+        self._close_writer()
@@ -17,9 +17,15 @@ GET /edit/type  # get editing mask (form) for a new type (no name yet)
 POST /edit/type  # submit form to create a new type
 
 
-GET /list/object/mytype  # list all objects of type mytype
+GET /list/object/mytype  # list all objects of type mytype, first page
+GET /list/object/mytype?cursor=...  # next page as table rows (htmx infinite scroll)
+
+GET /search?q=some+words  # ranked full-text search over latest object versions (htmx fragment)
+
+GET /changes?since=42  # Server-Sent Events of saved objects after sequence number 42 (optionally &view=mytype)
 
 GET /show/object/mytype/111  # show object with ID 111 as mytype
+GET /show/object/mytype/111?at=2024-01-31T12:00  # ... as it was at that time (or ms since epoch)
 
 GET /edit/object/mytype/111  # get editing mask (form) for type mytype for object 111
 PATCH /edit/object/mytype/111  # submit form to update object 111
@@ -0,0 +1,184 @@
+"""Type definitions of the objects of a view, and validators compiled from them.
+
+>>> check = compile_definition(
+...     {"fields": [{"type": "text", "name": "name"}, {"type": "date", "name": "born"}]}
+... )
+>>> check({"name": "Ada", "born": "1815-12-10", "ignored": ""})
+{'name': 'Ada', 'born': '1815-12-10'}
+>>> check({"born": "10.12.1815"})
+Traceback (most recent call last):
+...
+typedefs.ValidationError: born: not a date (YYYY-MM-DD): '10.12.1815'
+"""
+import json
+from datetime import date
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+type_definitions_path = Path(__file__).parent / "type_definitions"
+
+Validator = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+class ValidationError(ValueError):
+    """Raised by validators, `errors` maps field names to messages."""
+
+    def __init__(self, errors: Dict[str, str]) -> None:
+        super().__init__("; ".join(f"{k}: {v}" for k, v in errors.items()))
+        self.errors = errors
+
+
+def definition_path(type_name: str) -> Path:
+    return type_definitions_path / f"{type_name}-type-definition.json"
+
+
+def list_types() -> List[str]:
+    suffix = "-type-definition.json"
+    return sorted(p.name[: -len(suffix)] for p in type_definitions_path.glob("*" + suffix))
+
+
+def load(type_name: str) -> Dict[str, Any]:
+    with open(definition_path(type_name), "r") as f:
+        return json.load(f)
+
+
+def field_names(definition: Dict[str, Any], field_type: Optional[str] = None) -> List[str]:
+    return [
+        field["name"]
+        for field in definition.get("fields", [])
+        if field_type is None or field["type"] == field_type
+    ]
+
+
+def _text(value: Any) -> str:
+    if not isinstance(value, str):
+        raise ValueError(f"not text: {value!r}")
+    return value
+
+
+def _date(value: Any) -> str:
+    try:
+        return date.fromisoformat(value.strip()).isoformat()
+    except (AttributeError, ValueError):
+        raise ValueError(f"not a date (YYYY-MM-DD): {value!r}") from None
+
+
+def _number(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"not a number: {value!r}")
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"not a number: {value!r}") from None
+
+
+def _integer(value: Any) -> int:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lstrip("+-").isdigit():
+        return int(value)
+    raise ValueError(f"not an integer: {value!r}")
+
+
+def _boolean(value: Any) -> bool:
+    # unchecked checkboxes are not submitted at all
+    if isinstance(value, bool):
+        return value
+    if value in ("on", "true", "1"):
+        return True
+    if value in ("off", "false", "0"):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+def _reference(value: Any) -> Union[int, List[int]]:
+    # object id or ids, forms submit them separated by commas
+    if isinstance(value, str) and "," in value:
+        value = [v for v in value.split(",") if v.strip()]
+    try:
+        if isinstance(value, list):
+            return [_integer(v) for v in value]
+        return _integer(value)
+    except ValueError:
+        raise ValueError(f"not an object id or a list of them: {value!r}") from None
+
+
+# field type -> function coercing submitted values, raising ValueError
+coercers = dict(
+    text=_text,
+    date=_date,
+    number=_number,
+    integer=_integer,
+    boolean=_boolean,
+    reference=_reference,
+)  # type: Dict[str, Callable[[Any], Any]]
+
+
+def compile_definition(definition: Dict[str, Any]) -> Validator:
+    """Turn a definition into a function that returns the coerced known
+    fields of an object, leaving out empty ones (as submitted by forms), or
+    raises ValidationError. Fields with "required": true must be present.
+    """
+    fields = []
+    for field in definition.get("fields", []):
+        if field["type"] not in coercers:
+            raise ValueError(f"unknown type {field['type']!r} of field {field['name']!r}")
+        fields.append((field["name"], coercers[field["type"]], field.get("required", False)))
+    fields = tuple(fields)
+
+    def validate(data: Dict[str, Any]) -> Dict[str, Any]:
+        result = {}
+        errors = {}
+        for name, coerce, required in fields:
+            value = data.get(name)
+            if value is None or value == "":
+                if required:
+                    errors[name] = "required"
+                continue
+            try:
+                result[name] = coerce(value)
+            except ValueError as e:
+                errors[name] = str(e)
+        if errors:
+            raise ValidationError(errors)
+        return result
+
+    return validate
+
+
+_validators = {}  # type: Dict[str, Tuple[int, Validator]]
+
+
+def validator(type_name: str) -> Optional[Validator]:
+    """The compiled validator of a type, or None if it has no definition.
+    Definitions are compiled again when their file changes.
+    """
+    try:
+        mtime = definition_path(type_name).stat().st_mtime_ns
+    except FileNotFoundError:
+        _validators.pop(type_name, None)
+        return None
+    cached = _validators.get(type_name)
+    if cached is None or cached[0] != mtime:
+        cached = _validators[type_name] = (mtime, compile_definition(load(type_name)))
+    return cached[1]
+
+
+def validate_many(
+    type_name: str, objects: Iterable[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[Tuple[int, ValidationError]]]:
+    """Validate a batch with one lookup of the validator. Returns the valid
+    objects (unchanged if the type has no definition) and (index,
+    ValidationError) of the others.
+    """
+    validate = validator(type_name)
+    if validate is None:
+        return list(objects), []
+    valid = []
+    errors = []
+    for i, data in enumerate(objects):
+        try:
+            valid.append(validate(data))
+        except ValidationError as e:
+            errors.append((i, e))
+    return valid, errors
@@ -3,8 +3,13 @@ from collections import Counter
 import random
 from datetime import datetime
 from uuid import uuid4
-from bottle import Bottle, request, static_file
+import json
+import re
+import threading
+import time
+from bottle import Bottle, CompressionPlugin, StaticCache, abort, request, response, static_file
 from htmltags import *
+import main as store
 
 bulma_css_path = "/static/css/bulma.min.css"
 htmx_path = "/static/js/htmx.min.js"
@@ -84,6 +89,51 @@ def console_window(url):
     )
 
 
+def search_box(url):
+    return div(
+        input(
+            name="q",
+            type="search",
+            placeholder="Search...",
+            hx_get=url,
+            hx_trigger="input changed delay:150ms, search",
+            hx_target="#search-results",
+            hx_sync="this:replace",
+            class_="input",
+        ),
+        div(id="search-results"),
+        class_="box",
+    )
+
+
+_snippet_marks = re.compile(f"{store.snippet_start}(.*?){store.snippet_end}")
+
+
+def highlighted(snippet):
+    parts = _snippet_marks.split(snippet)
+    # odd parts are the matches
+    return [
+        span(part, class_="has-text-weight-bold") if i % 2 else part
+        for i, part in enumerate(parts)
+        if part
+    ]
+
+
+def search_results(hits):
+    if not hits:
+        return p("Nothing found", class_="has-text-grey")
+    return ul(
+        *[
+            li(
+                a(f"{view} {object_id}", href=f"/show/object/{view}/{object_id}"),
+                ": ",
+                *highlighted(snippet),
+            )
+            for object_id, view, snippet in hits
+        ]
+    )
+
+
 def home_page(greeting):
     return html(
         head(title("A Test of HTML generation"), bulma_css),
@@ -91,6 +141,7 @@ def home_page(greeting):
             navbar("My Page", ["First", "Second", "Third"]),
             main(
                 h1("A Test of HTML generation", class_="title"),
+                search_box("/search"),
                 div(hx_trigger="load", hx_swap="outerHTML", hx_get="/counter/first"),
                 div(hx_trigger="load", hx_swap="outerHTML", hx_get="/counter/second"),
                 div(hx_trigger="load", hx_swap="outerHTML", hx_get="/counter/first"),
@@ -110,12 +161,135 @@ def home_page(greeting):
     )
 
 
+def parse_timestamp(at):
+    """Milliseconds since the epoch from either a number or an ISO date."""
+    if at.isdigit():
+        return int(at)
+    return int(datetime.fromisoformat(at).timestamp() * 1000)
+
+
+def change_listener(since):
+    """Subscribe to the change feed from sequence number `since` and fire a
+    "changed" htmx event on every element showing a changed object (marked
+    by a data-object-id attribute), which then reloads itself. Hidden tabs
+    close the feed, as browsers allow only 6 connections per host and each
+    feed holds a server thread, and resume from the last change when shown.
+    """
+    return script(
+        f"let since = {since};\n"
+        "let changes = null;\n"
+        "function listen() {\n"
+        "  changes = new EventSource(`/changes?since=${since}`);\n"
+        "  changes.onmessage = (event) => {\n"
+        "    since = event.lastEventId || since;\n"
+        "    const id = JSON.parse(event.data).object_id;\n"
+        "    document.querySelectorAll(`[data-object-id='${id}']`)\n"
+        '      .forEach((element) => htmx.trigger(element, "changed"));\n'
+        "  };\n"
+        '  changes.addEventListener("reset", () => location.reload());\n'
+        "}\n"
+        'document.addEventListener("visibilitychange", () => {\n'
+        "  if (document.hidden && changes) {\n"
+        "    changes.close();\n"
+        "    changes = null;\n"
+        "  } else if (!document.hidden && !changes) {\n"
+        "    listen();\n"
+        "  }\n"
+        "});\n"
+        "if (!document.hidden) listen();"
+    )
+
+
+def object_page(view, row, live=True):
+    object_id, version, _, data = row
+    refresh = {}
+    if live:
+        refresh = dict(
+            data_object_id=str(object_id),
+            hx_get=f"/show/object/{view}/{object_id}",
+            hx_select=f"#object-{object_id}",
+            hx_trigger="changed",
+            hx_swap="outerHTML",
+        )
+    return html(
+        head(title(f"{view} {object_id}"), bulma_css),
+        body(
+            navbar("My Page", ["First", "Second", "Third"]),
+            main(
+                h1(f"{view} {object_id}", class_="title"),
+                div(
+                    p(
+                        f"Version of {datetime.fromtimestamp(version / 1000)}",
+                        class_="subtitle",
+                    ),
+                    table(
+                        tbody(*[tr(th(key), td(str(value))) for key, value in data.items()]),
+                        class_="table",
+                    ),
+                    id=f"object-{object_id}",
+                    **refresh,
+                ),
+                *([htmx_src, change_listener(store.changes.seq)] if live else []),
+                class_="container",
+            ),
+        ),
+    )
+
+
+def object_rows(view, rows, cursor):
+    """Table rows of the objects, the last one loading the page after it
+    when scrolled into view.
+    """
+    view = view.lower()
+    for i, (object_id, version, _, data) in enumerate(rows):
+        more = {}
+        if cursor and i == len(rows) - 1:
+            more = dict(
+                hx_get=f"/list/object/{view}?cursor={cursor}",
+                hx_trigger="revealed",
+                hx_swap="afterend",
+            )
+        yield tr(
+            td(a(str(object_id), href=f"/show/object/{view}/{object_id}")),
+            td(str(datetime.fromtimestamp(version / 1000))),
+            td(", ".join(f"{key}: {value}" for key, value in data.items())),
+            **more,
+        )
+
+
+def object_list_page(view, rows, cursor):
+    return html(
+        head(title(f"All {view}"), bulma_css),
+        body(
+            navbar("My Page", ["First", "Second", "Third"]),
+            main(
+                h1(f"All {view}", class_="title"),
+                table(
+                    thead(tr(th("ID"), th("Version"), th("Data"))),
+                    tbody(*object_rows(view, rows, cursor)),
+                    class_="table is-fullwidth",
+                ),
+                htmx_src,
+                class_="container",
+            ),
+        ),
+    )
+
+
 myapp = Bottle()
+myapp.install(CompressionPlugin())
+
+assets_path = Path(__file__).parent / "assets"
+
+# bulma and htmx served from memory, None to read them from disk every time
+static_cache = StaticCache(max_bytes=8 * 1024 * 1024)
 
 
 @myapp.route("/static/<path:path>")
 def static_files(path):
-    return static_file(path, root=Path(__file__).parent / "assets")
+    if static_cache is None:
+        return static_file(path, root=assets_path)
+    return static_cache.serve(path, root=assets_path)
 
 
 @myapp.route("/")
@@ -139,6 +313,91 @@ def line():
     return p(f"{datetime.now()} >>> {request.forms.get('line')}")
 
 
+@myapp.get("/show/object/<type>/<id:int>")
+def show_object(type, id):
+    at = request.query.at
+    try:
+        view_id = store.get_view_id(type)
+        row = store.get_at(id, parse_timestamp(at)) if at else store.get_latest(id)
+    except store.UnknownViewError:
+        row = None
+    except (ValueError, OverflowError) as e:
+        abort(400, f"Invalid time {at!r}: {e}")
+    if row is None or row[2] != view_id:
+        abort(404, f"No {type} {id}")
+    return object_page(type, row, live=not at)
+
+
+keepalive_interval = 15  # seconds between comments keeping proxies from closing
+stream_duration = 300  # seconds before a feed is closed, browsers reconnect
+max_feeds = 48  # feeds open at once, each holds a server thread (see threads=)
+busy_retry = 10000  # milliseconds before a feed turned away by max_feeds retries
+feed_slots = threading.BoundedSemaphore(max_feeds)
+
+
+@myapp.get("/changes")
+def change_feed():
+    """Server-Sent Events of saved objects, optionally of one `view`,
+    after the sequence number in the Last-Event-ID header (sent when the
+    browser reconnects) or the `since` parameter. A "reset" event means
+    changes were missed. Beyond `max_feeds` open feeds, the stream only
+    tells the browser to retry later.
+    """
+    since = request.get_header("Last-Event-ID") or request.query.since
+    if not since.isdigit():
+        abort(400, "Last-Event-ID or since must be a sequence number")
+    view = request.query.view.lower() or None
+    response.content_type = "text/event-stream"
+    response.set_header("Cache-Control", "no-cache")
+
+    def events(seq):
+        if not feed_slots.acquire(blocking=False):
+            # spread the retries, so turned away browsers don't return together
+            yield f"retry: {random.randint(busy_retry, 2 * busy_retry)}\n\n"
+            return
+        try:
+            end = time.monotonic() + stream_duration
+            yield "retry: 1000\n\n"
+            while time.monotonic() < end:
+                changes = store.changes.since(seq, keepalive_interval)
+                if changes is None:
+                    seq = store.changes.seq
+                    yield f"id: {seq}\nevent: reset\ndata: \n\n"
+                elif not changes:
+                    yield ": keepalive\n\n"
+                else:
+                    seq = changes[-1][0]
+                    yield "".join(
+                        f"id: {seq}\ndata: {json.dumps(change)}\n\n"
+                        for seq, change in changes
+                        if view is None or change["view"] == view
+                    ) or f"id: {seq}\n\n"  # an id without data moves Last-Event-ID
+        finally:
+            feed_slots.release()
+
+    return events(int(since))
+
+
+@myapp.get("/list/object/<type>")
+def list_objects(type):
+    cursor = request.query.cursor or None
+    try:
+        rows, next_cursor = store.list_page(type, cursor)
+    except store.UnknownViewError as e:
+        abort(404, str(e))
+    except ValueError as e:
+        abort(400, str(e))
+    if cursor is None:
+        return object_list_page(type, rows, next_cursor)
+    # infinite scroll: just the rows, streamed as they are rendered
+    return (chunk for row in object_rows(type, rows, next_cursor) for chunk in row)
+
+
+@myapp.get("/search")
+def search():
+    return search_results(store.search(request.query.q or ""))
+
+
 remove_count = 0
 
 
@@ -168,5 +427,16 @@ def hello(id):
     )
 
 
-print(f"{id(myapp):0x}")
-myapp.run(host="localhost", port=8080, debug=True, reloader=True)
+if __name__ == "__main__":
+    print(f"{id(myapp):0x}")
+    myapp.run(
+        host="localhost",
+        port=8080,
+        debug=True,
+        reloader=True,
+        server="threaded",
+        # change feeds hold a thread each for up to stream_duration, and would
+        # delay reloads; max_feeds of them leave 16 threads for everything else
+        threads=64,
+        shutdown_timeout=2,
+    )
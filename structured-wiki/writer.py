@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import Future
+from queue import Empty, Queue
+from typing import Any, List, Tuple
+import main
+
+
+class WriteBehind(object):
+    """Group commit for main.save(): a writer thread collects submitted saves
+    for up to `max_delay` seconds or `max_items` items and writes them with
+    one main.save_many() transaction. Each submit() returns a Future that
+    resolves once its transaction has committed, so a caller that waits for
+    it reads its own write afterwards.
+
+    With the default `max_delay` of 0 a batch is whatever queued up while
+    the previous transaction was committing; lingering only pays off when
+    commits are much slower than the wait (e.g. synchronous="full" on a
+    disk with slow fsync).
+    """
+
+    def __init__(self, max_items: int = 256, max_delay: float = 0.0) -> None:
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.batches = 0
+        self.items = 0
+        self._queue = Queue()  # type: Queue
+        self._thread = None  # type: threading.Thread
+        self._lock = threading.Lock()
+
+    def submit(self, object_id: Any, view: str, data: Any) -> Future:
+        future = Future()  # type: Future
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="write-behind", daemon=True
+                )
+                self._thread.start()
+            self._queue.put(((object_id, view, data, None), future))
+        return future
+
+    def _collect(self) -> List[Any]:
+        pending = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while pending[-1] is not None and len(pending) < self.max_items:
+            try:
+                timeout = max(deadline - time.monotonic(), 0)
+                pending.append(self._queue.get(timeout=timeout))
+            except Empty:
+                break
+        return pending
+
+    def _save(self, pending: List[Tuple[Any, Future]]) -> None:
+        try:
+            main.save_many([item for item, _ in pending])
+        except Exception as e:
+            # items of shards that committed before the failure are done
+            saved = set(getattr(e, "saved", ()))
+            for i in saved:
+                pending[i][1].set_result(None)
+            self.items += len(saved)
+            pending = [p for i, p in enumerate(pending) if i not in saved]
+            if len(pending) == 1:
+                pending[0][1].set_exception(e)
+            else:
+                # save one by one so that only the culprits fail
+                for p in pending:
+                    self._save([p])
+            return
+        self.batches += 1
+        self.items += len(pending)
+        for _, future in pending:
+            future.set_result(None)
+
+    def _run(self) -> None:
+        while True:
+            pending = self._collect()
+            stop = pending[-1] is None
+            running = [
+                (item, future)
+                for item, future in (pending[:-1] if stop else pending)
+                if future.set_running_or_notify_cancel()
+            ]
+            if running:
+                self._save(running)
+            if stop:
+                return
+
+    def close(self) -> None:
+        """Write everything submitted so far and stop the writer thread."""
+        with self._lock:
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+                self._thread = None